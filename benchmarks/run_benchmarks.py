@@ -0,0 +1,195 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Benchmarks of the preprocessing and dashboard hot paths, on the synthetic datasets of `synthetic_data.py`.
+#
+# For each size, the datasets are generated once in `benchmarks/work/<size>/data` (reused by the next runs,
+# until `synthetic_data.VERSION` changes), then every stage is run `--repeat` times on a fresh copy of its input and reports:
+# - `seconds`: the best time of the runs, and `mean_seconds`
+# - `peak_memory_mb`: the peak of the memory allocated by the stage (`tracemalloc`, numpy and pandas buffers included)
+#
+# The results are written as JSON with the commit they were measured on, `--compare` prints the change
+# against a previous results file:
+#	python benchmarks/run_benchmarks.py --sizes 10k 100k 1M --output benchmarks/results.json
+#	python benchmarks/run_benchmarks.py --output benchmarks/new_results.json --compare benchmarks/results.json
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from synthetic_data import generate, generated_version, VERSION
+
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000, '10M': 10_000_000}
+DEFAULT_SIZES = ['10k', '100k']
+WORK_DIR = os.path.join(BENCHMARKS_DIR, 'work')
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def commit_hash():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+# Runs `func(*make_args())` `repeat` times, the arguments are built outside of the measure (copies of the input)
+def measure(func, make_args, repeat):
+	times = []
+	peak = 0
+	for _ in range(repeat):
+		args = make_args()
+		gc.collect()
+		tracemalloc.start()
+		start = time.perf_counter()
+		result = func(*args)
+		times.append(time.perf_counter() - start)
+		peak = max(peak, tracemalloc.get_traced_memory()[1])
+		tracemalloc.stop()
+	stats = {
+		'seconds': round(min(times), 6),
+		'mean_seconds': round(sum(times) / len(times), 6),
+		'peak_memory_mb': round(peak / 1024 ** 2, 3),
+	}
+	return result, stats
+
+# The datasets of an older generator version (e.g. without the id columns) are generated again, with the outputs
+# of the previous runs (cache, state) which depend on them
+def prepare_data(rows):
+	work_dir = os.path.join(WORK_DIR, str(rows))
+	if generated_version(work_dir) != VERSION:
+		shutil.rmtree(work_dir, ignore_errors=True)
+		print(f'Generating the synthetic datasets ({rows:,} rows) in `{work_dir}`')
+		generate(rows, work_dir)
+	return work_dir
+
+# The stages are run in the order of the pipeline, the output of one is the input of the next
+def run_stages(repeat):
+	import pandas as pd
+	import epoints_preprocess as epoints_script
+	import vehicles_preprocess as vehicles_script
+	from ingest import load_cached_csv, EPOINTS_SPEC
+
+	results = {}
+
+	def run(name, func, make_args):
+		result, results[name] = measure(func, make_args, repeat)
+		print(f'	{name:<40} {results[name]["seconds"]:>10.4f} s {results[name]["peak_memory_mb"]:>10.1f} MB')
+		return result
+
+	# Charging points
+	epoints = load_cached_csv('data/charging_points.csv', EPOINTS_SPEC)
+	epoints = epoints_script.select_columns(epoints, ['adresse_station', 'coordonneesXY', 'consolidated_code_postal', 'created_at', 'id_pdc_itinerance', 'id_station_itinerance'])
+
+	df = run('extract_postal_code_from_str', epoints_script.extract_postal_code_from_str, lambda: (epoints.copy(),))
+	df['postal_code'] = df['postal_code'].fillna(df['consolidated_code_postal'])
+	df = run('map_coordinates_to_postal_code', epoints_script.map_coordinates_to_postal_code, lambda: (df.copy(),))
+	df = run('hash_keys', epoints_script.hash_keys, lambda: (df.copy(),))
+	df = run('postal_code_manual_fixes', lambda df: epoints_script.postal_code_manual_fixes(df, report_path=None), lambda: (df.copy(),))
+	df['postal_code'] = df['postal_code'].where(df['postal_code'].isnull(), df['postal_code'].astype(str))
+	df = run('epoints.adding_department', epoints_script.adding_department, lambda: (df.copy(),))
+	epoints_pivot = run('transform_data', epoints_script.transform_data, lambda: (df.copy(),))
+	run('transform_data.points', lambda df: epoints_script.transform_data(df, 'points'), lambda: (df.copy(),))
+	run('transform_data.stations', lambda df: epoints_script.transform_data(df, 'stations'), lambda: (df.copy(),))
+
+	# Vehicles
+	evs = vehicles_script.load_dataset()
+	evs = run('vehicles.adding_department', vehicles_script.adding_department, lambda: (evs.copy(),))
+	evs_pivot = run('transform_to_pivot', vehicles_script.transform_to_pivot, lambda: (evs.copy(),))
+
+	# Outputs read by the dashboard
+	epoints_script.save_pivot(epoints_pivot)
+	vehicles_script.save_pivot(evs_pivot)
+	from build_geojson import build_enriched_geojson, save_geojson, DEFAULT_TIER
+	save_geojson(build_enriched_geojson(DEFAULT_TIER), DEFAULT_TIER)
+
+	# Dashboard (the functions behind the Streamlit caches)
+	import folium
+	import map_dashboard
+	load_datasets = getattr(map_dashboard.load_datasets, '__wrapped__', map_dashboard.load_datasets)
+	depts, years, cube = run('load_datasets', load_datasets, lambda: ())
+	ratio_cum = map_dashboard.cube_frame(depts, years, cube, 'ratio_cum')
+
+	def choropleth(ratio_cum, year):
+		map = folium.Map(location=[46.603354, 1.8883344], zoom_start=6)
+		map_dashboard.create_choropleth(map, ratio_cum, year, 'Véhicules électriques par borne de recharge')
+		return folium.Figure().add_child(map).render()
+	run('create_choropleth', choropleth, lambda: (ratio_cum, years[-1]))
+
+	return results
+
+def run_benchmarks(sizes, repeat):
+	import pandas as pd
+	import numpy as np
+
+	report = {
+		'commit': commit_hash(),
+		'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+		'python': platform.python_version(),
+		'pandas': pd.__version__,
+		'numpy': np.__version__,
+		'machine': platform.machine(),
+		'repeat': repeat,
+		'results': {},
+	}
+	cwd = os.getcwd()
+	for size in sizes:
+		rows = SIZES[size]
+		work_dir = prepare_data(rows)
+		print(f'{size} ({rows:,} rows)')
+		# The scripts use paths relative to the repository root (`data/...`)
+		os.chdir(work_dir)
+		try:
+			report['results'][size] = run_stages(repeat)
+		finally:
+			os.chdir(cwd)
+	return report
+
+def compare(report, previous):
+	print(f'Comparison with `{previous.get("commit")}` ({previous.get("date")}):')
+	for size, stages in report['results'].items():
+		for name, stats in stages.items():
+			before = previous.get('results', {}).get(size, {}).get(name)
+			if before is None or before['seconds'] == 0:
+				continue
+			change = (stats['seconds'] - before['seconds']) / before['seconds']
+			memory = stats['peak_memory_mb'] - before['peak_memory_mb']
+			print(f'	{size:<5} {name:<40} {change:>+8.1%} time {memory:>+10.1f} MB')
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Benchmarks of the preprocessing and dashboard hot paths')
+	parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=DEFAULT_SIZES)
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--output', default=os.path.join(BENCHMARKS_DIR, 'results.json'))
+	parser.add_argument('--compare', metavar='RESULTS_JSON', help='Previous results to compare with')
+	return parser.parse_args()
+
+def main():
+	args = parse_args()
+	previous = None
+	if args.compare:
+		with open(args.compare) as f:
+			previous = json.load(f)
+
+	report = run_benchmarks(args.sizes, args.repeat)
+	with open(args.output, 'w') as f:
+		json.dump(report, f, indent=2)
+	print(f'The results have been saved to `{args.output}`')
+
+	if previous is not None:
+		compare(report, previous)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,192 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Synthetic datasets for the benchmarks, with the same layout as the real ones:
+# - `charging_points.csv`: addresses with/without postal code, with SIRET or phone numbers, the different
+#	`coordonneesXY` formats, missing `consolidated_code_postal`, `created_at` over several years,
+#	stations of several points and points declared twice (`id_station_itinerance`, `id_pdc_itinerance`)
+# - `voitures.csv`: one row per commune and quarter (`CODGEO`, `DATE_ARRETE`, `NB_VP_RECHARGEABLES_EL`, ...)
+# - `fr-ref-geo.csv`, `france_departments.geojson` (a grid of square departments with detailed borders),
+#	plus a copy of `code-postal-corse.csv` and `postal_code_overrides.csv`
+#
+# Usage: python benchmarks/synthetic_data.py --rows 100000 --output benchmarks/work/100000
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+
+REPO_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+DEPT_CODES = [str(i).zfill(2) for i in range(1, 96) if i != 20] + ['2A', '2B']
+STREETS = np.array(['Rue de la République', 'Avenue Jean Jaurès', 'Boulevard Victor Hugo', 'Place de la Mairie',
+	'Route Nationale', 'Chemin des Vignes', 'Parking du Centre Commercial', 'Zone Industrielle', 'Rue Pasteur'])
+CITIES = np.array(['Paris', 'Lyon', 'Marseille', 'Toulouse', 'Nantes', 'Ajaccio', 'Bastia', 'Lille', 'Rennes', 'Dijon'])
+# To increase when the layout of the generated files changes (e.g. new columns): the datasets generated by an older
+# version are generated again by the benchmarks. Written last to `data/synthetic_version`, so an interrupted run is not reused
+VERSION = 2
+VERSION_FILE = 'synthetic_version'
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def corsica_postal_codes():
+	df = pd.read_csv(os.path.join(REPO_DATA, 'code-postal-corse.csv'), sep=';', dtype=str)
+	return df['Code_postal'].dropna().unique()
+
+# Approximate position of each department on a grid covering mainland France
+def dept_positions():
+	positions = {}
+	for i, code in enumerate(DEPT_CODES):
+		positions[code] = (42.5 + (i // 10) * 0.9, -4.5 + (i % 10) * 1.2)
+	return positions
+
+def generate_charging_points(rows, rng):
+	corsica = corsica_postal_codes()
+	dept = rng.choice(DEPT_CODES, rows)
+	suffix = pd.Series(rng.integers(0, 1000, rows)).astype(str).str.zfill(3)
+	postal_code = pd.Series(dept).str.replace('2A', '20').str.replace('2B', '20') + suffix
+	mask_corsica = np.isin(dept, ['2A', '2B'])
+	postal_code[mask_corsica] = rng.choice(corsica, mask_corsica.sum())
+
+	number = pd.Series(rng.integers(1, 300, rows)).astype(str)
+	street = pd.Series(rng.choice(STREETS, rows))
+	city = pd.Series(rng.choice(CITIES, rows))
+	# 70% regular addresses, 10% with a SIRET before the postal code, 5% with a phone number, 15% without postal code
+	kind = rng.choice(4, rows, p=[0.70, 0.10, 0.05, 0.15])
+	address = number + ' ' + street + ' ' + postal_code + ' ' + city
+	siret = pd.Series(rng.integers(10 ** 13, 10 ** 14, rows)).astype(str)
+	address = address.where(kind != 1, 'SIRET ' + siret + ' - ' + address)
+	phone = '0' + pd.Series(rng.integers(10 ** 8, 10 ** 9, rows)).astype(str)
+	address = address.where(kind != 2, address + ' tel ' + phone)
+	address = address.where(kind != 3, number + ' ' + street + ' ' + city)
+
+	positions = dept_positions()
+	lat = np.array([positions[d][0] for d in dept]) + rng.random(rows) * 0.8
+	lon = np.array([positions[d][1] for d in dept]) + rng.random(rows) * 1.1
+	lat_str = pd.Series(lat.round(6)).astype(str)
+	lon_str = pd.Series(lon.round(6)).astype(str)
+	# The different formats of `coordonneesXY` found in the consolidated file
+	fmt = rng.choice(3, rows)
+	coords = '[' + lon_str + ', ' + lat_str + ']'
+	coords = coords.where(fmt != 1, '[' + lon_str + ' , ' + lat_str + ']')
+	coords = coords.where(fmt != 2, '[' + lon_str + ',' + lat_str + ']')
+
+	# Stations of up to 3 points sharing the coordinates of the station, 2% of the points declared twice
+	row = np.arange(rows)
+	station = row // 3
+	lat_str = pd.Series(lat_str.to_numpy()[station * 3])
+	lon_str = pd.Series(lon_str.to_numpy()[station * 3])
+	coords = pd.Series(coords.to_numpy()[station * 3])
+	station_id = 'FRSYNS' + pd.Series(station).astype(str).str.zfill(7)
+	point = pd.Series(row % 3)
+	redeclared = (rng.random(rows) < 0.02) & (point > 0)
+	point[redeclared] -= 1
+	point_id = station_id.str.replace('FRSYNS', 'FRSYNP') + point.astype(str)
+
+	consolidated = postal_code.where(rng.random(rows) > 0.2, None)
+
+	year = pd.Series(rng.integers(2021, 2026, rows)).astype(str)
+	month = pd.Series(rng.integers(1, 13, rows)).astype(str).str.zfill(2)
+	created_at = year + '-' + month + '-15T10:00:00+00:00'
+
+	return pd.DataFrame({
+		'nom_station': 'Station ' + number,
+		'adresse_station': address,
+		'coordonneesXY': coords,
+		'consolidated_code_postal': consolidated,
+		'consolidated_latitude': lat_str,
+		'consolidated_longitude': lon_str,
+		'created_at': created_at,
+		'id_station_itinerance': station_id,
+		'id_pdc_itinerance': point_id,
+	})
+
+def generate_vehicles(rows, rng):
+	quarters = [f'{year}-{month}-{day}' for year in range(2020, 2026) for month, day in [('03', '31'), ('06', '30'), ('09', '30'), ('12', '31')]]
+	communes = max(rows // len(quarters), 1)
+	dept = rng.choice(DEPT_CODES + ['97'], communes)
+	codgeo = pd.Series(dept) + pd.Series(rng.integers(0, 1000, communes)).astype(str).str.zfill(3)
+
+	codgeo = np.tile(codgeo.to_numpy(), len(quarters))[:rows]
+	date_arrete = np.repeat(quarters, communes)[:rows]
+	nb_evs = rng.integers(0, 500, len(codgeo)).astype(str).astype(object)
+	# Secret statistique
+	nb_evs[rng.random(len(codgeo)) < 0.01] = 's'
+
+	return pd.DataFrame({
+		'CODGEO': codgeo,
+		'LIBGEO': 'Commune ' + pd.Series(codgeo),
+		'EPCI': '200000000',
+		'LIBEPCI': 'CC Synthétique',
+		'DATE_ARRETE': date_arrete,
+		'NB_VP_RECHARGEABLES_EL': nb_evs,
+	})
+
+def generate_ref_geo():
+	codes = DEPT_CODES + ['971', '972', '973', '974', '976']
+	return pd.DataFrame({'DEP_CODE': codes, 'DEP_NOM': ['Département ' + c for c in codes]})
+
+# Square departments on the same grid as `dept_positions()`, `points_per_side` points per border
+def generate_geojson(points_per_side=300, rng=None):
+	rng = rng or np.random.default_rng(0)
+	step_lat, step_lon = 0.9, 1.2
+	# The borders are shared between neighbours: the noise only depends on the position of the point
+	def noise(a, b):
+		return 0.01 * np.sin(a * 37.0 + b * 11.0)
+
+	features = []
+	for code, (lat0, lon0) in dept_positions().items():
+		t = np.linspace(0, 1, points_per_side, endpoint=False)
+		sides = [
+			(lon0 + t * step_lon, np.full_like(t, lat0)),
+			(np.full_like(t, lon0 + step_lon), lat0 + t * step_lat),
+			(lon0 + step_lon - t * step_lon, np.full_like(t, lat0 + step_lat)),
+			(np.full_like(t, lon0), lat0 + step_lat - t * step_lat),
+		]
+		ring = []
+		for lons, lats in sides:
+			for x, y in zip(lons, lats):
+				ring.append([round(float(x + noise(y, 0)), 6), round(float(y + noise(x, 1)), 6)])
+		ring.append(ring[0])
+		features.append({
+			'type': 'Feature',
+			'properties': {'code': code, 'nom': f'Département {code}'},
+			'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+		})
+	return {'type': 'FeatureCollection', 'features': features}
+
+def generate(rows, output, seed=0):
+	rng = np.random.default_rng(seed)
+	data_dir = os.path.join(output, 'data')
+	os.makedirs(data_dir, exist_ok=True)
+
+	generate_charging_points(rows, rng).to_csv(os.path.join(data_dir, 'charging_points.csv'), index=False)
+	generate_vehicles(rows, rng).to_csv(os.path.join(data_dir, 'voitures.csv'), sep=';', index=False)
+	generate_ref_geo().to_csv(os.path.join(data_dir, 'fr-ref-geo.csv'), sep=';', index=False)
+	with open(os.path.join(data_dir, 'france_departments.geojson'), 'w') as f:
+		json.dump(generate_geojson(rng=rng), f)
+	for name in ['code-postal-corse.csv', 'postal_code_overrides.csv']:
+		shutil.copy(os.path.join(REPO_DATA, name), data_dir)
+	with open(os.path.join(data_dir, VERSION_FILE), 'w') as f:
+		f.write(str(VERSION))
+
+def generated_version(output):
+	try:
+		with open(os.path.join(output, 'data', VERSION_FILE)) as f:
+			return int(f.read())
+	except (OSError, ValueError):
+		return None
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Synthetic `charging_points.csv` / `voitures.csv` datasets for the benchmarks')
+	parser.add_argument('--rows', type=int, default=100000)
+	parser.add_argument('--output', required=True, help='Directory in which the `data` folder is created')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+	generate(args.rows, args.output, args.seed)
+	print(f'Synthetic datasets ({args.rows:,} rows) saved to `{os.path.join(args.output, "data")}`')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,79 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# This script builds the GeoJSON files used by the dashboard `data/france_departments_enriched.<tier>.geojson`:
+# - the geometry of `data/france_departments.geojson` simplified (topology-preserving, see `geometry_simplify.py`)
+#	and quantised, one file per level of detail in `TIERS`
+# - the values of every year already embedded in the properties of each department:
+#	`e_charge_<year>`, `vehicles_<year>` and `ratio_<year>` (cumulative values, 'N/A' if missing)
+#	and the fill color of the ratio `fill_<year>`, on one scale for all the years (`ratio_bins`, `RATIO_COLORS`)
+# so the dashboard only has to pick which properties to show when the year changes (in the browser for the animation).
+#
+# It has to be run after `epoints_preprocess.py` and `vehicles_preprocess.py`, it reports the payload size of each tier:
+#	python build_geojson.py
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import json
+import numpy as np
+from geometry_simplify import simplify_geojson, geometry_polygons
+from metrics_cube import load_values
+
+
+SOURCE_GEOJSON = 'data/france_departments.geojson'
+# Levels of detail: simplification tolerance (degrees) and number of decimals kept in the coordinates
+# (0.001 degree is about 100m, 3 decimals about 100m, 4 decimals about 10m)
+TIERS = {
+	'high': {'tolerance': 0.0005, 'precision': 4},
+	'medium': {'tolerance': 0.002, 'precision': 3},
+	'low': {'tolerance': 0.01, 'precision': 3},
+}
+DEFAULT_TIER = 'medium'
+# Colors of the ratio classes (ColorBrewer `Set3`, same as the choropleth of the dashboard) and color of the missing values
+RATIO_COLORS = ['#8dd3c7', '#ffffb3', '#bebada', '#fb8072', '#80b1d3', '#fdb462']
+NAN_COLOR = '#000000'
+
+def geojson_path(tier):
+	return f'data/france_departments_enriched.{tier}.geojson'
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def build_enriched_geojson(tier=DEFAULT_TIER, source=SOURCE_GEOJSON):
+	with open(source) as f:
+		geojson_dict = json.load(f)
+	years, _, epoints_cum, evs_cum, ratio_cum = load_values()
+
+	# Equal width classes over the ratios of all the years
+	_, ratio_bins = np.histogram(ratio_cum.to_numpy(), bins=len(RATIO_COLORS))
+	ratio_classes = np.clip(np.searchsorted(ratio_bins, ratio_cum.to_numpy(), side='right') - 1, 0, len(RATIO_COLORS) - 1)
+	ratio_fill = dict(zip(ratio_cum.index, np.array(RATIO_COLORS)[ratio_classes].tolist()))
+
+	simplify_geojson(geojson_dict, **TIERS[tier])
+	for feature in geojson_dict['features']:
+		code = feature['properties']['code']
+		for i, year in enumerate(years):
+			feature['properties'][f'e_charge_{year}'] = int(epoints_cum.at[code, year]) if code in epoints_cum.index else 'N/A'
+			feature['properties'][f'vehicles_{year}'] = int(evs_cum.at[code, year]) if code in evs_cum.index else 'N/A'
+			feature['properties'][f'ratio_{year}'] = int(ratio_cum.at[code, year]) if code in ratio_cum.index else 'N/A'
+			feature['properties'][f'fill_{year}'] = ratio_fill[code][i] if code in ratio_fill else NAN_COLOR
+	geojson_dict['years'] = years
+	geojson_dict['ratio_bins'] = ratio_bins.tolist()
+
+	return geojson_dict
+
+def save_geojson(geojson_dict, tier):
+	with open(geojson_path(tier), 'w') as f:
+		json.dump(geojson_dict, f, separators=(',', ':'))
+
+def count_points(geojson_dict):
+	return sum(len(ring) for feature in geojson_dict['features'] for polygon in geometry_polygons(feature['geometry']) for ring in polygon)
+
+
+def main():
+	print(f'Source `{SOURCE_GEOJSON}`: {os.path.getsize(SOURCE_GEOJSON) / 1024:,.0f} KB')
+	for tier in TIERS:
+		geojson_dict = build_enriched_geojson(tier)
+		save_geojson(geojson_dict, tier)
+		print(f'Tier `{tier}` saved to `{geojson_path(tier)}`: {count_points(geojson_dict):,} points, {os.path.getsize(geojson_path(tier)) / 1024:,.0f} KB')
+	print(f'Years: {", ".join(geojson_dict["years"])}')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,80 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# This script checks that `epoints_preprocess.py --incremental` gives the same pivot table as a full run,
+# on a synthetic `charging_points.csv` (see `benchmarks/synthetic_data.py`) changed between two runs:
+# removed rows, modified rows (the postal code removed from the address) and new rows, half of them without
+# any postal code so they need the GPS based fill, which also changes the fill of the already processed rows.
+#
+# Each count mode is checked after two incremental runs in a row. The files are written in a temporary folder.
+#
+# Usage: python check_incremental.py [--rows 20000]
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import sys
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+from synthetic_data import generate, generate_charging_points
+
+from epoints_preprocess import load_dataset, run_full, run_incremental, COUNT_MODES
+
+
+# Removing, modifying and adding `changes` rows of `charging_points.csv`
+def change_dataset(changes, seed):
+	rng = np.random.default_rng(seed)
+	df = pd.read_csv('data/charging_points.csv', dtype=str)
+	df = df.drop(index=rng.choice(len(df), changes, replace=False)).reset_index(drop=True)
+	modified = rng.choice(len(df), changes, replace=False)
+	df.loc[modified, 'adresse_station'] = 'Rue sans code postal'
+	df.loc[modified, 'consolidated_code_postal'] = None
+
+	new = generate_charging_points(changes, np.random.default_rng(seed + 100))
+	new['id_station_itinerance'] += f'-{seed}'
+	new['id_pdc_itinerance'] += f'-{seed}'
+	new.loc[::2, 'adresse_station'] = 'Nouvelle station'
+	new.loc[::2, 'consolidated_code_postal'] = None
+	pd.concat([df, new], ignore_index=True).to_csv('data/charging_points.csv', index=False)
+
+def compare_modes(rows, changes):
+	differences = {}
+	for count in COUNT_MODES:
+		generate(rows, '.')
+		run_full(load_dataset(), count=count)
+		for seed in [1, 2]:
+			change_dataset(changes, seed)
+			incremental_pivot, _ = run_incremental(load_dataset(), count=count)
+		full_pivot, _ = run_full(load_dataset(), count=count)
+
+		difference = incremental_pivot.sub(full_pivot, fill_value=0)
+		differences[count] = difference[(difference != 0).any(axis=1)]
+	return differences
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Incremental run against a full run, on a synthetic dataset')
+	parser.add_argument('--rows', type=int, default=20000)
+	parser.add_argument('--changes', type=int, default=300, help='Number of removed, of modified and of new rows')
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		cwd = os.getcwd()
+		os.chdir(directory)
+		try:
+			differences = compare_modes(args.rows, args.changes)
+		finally:
+			os.chdir(cwd)
+
+	for count, difference in differences.items():
+		print(f'`--count {count}`: `{len(difference)}` department(s) differing from the full run')
+		if len(difference) > 0:
+			print(difference.to_string())
+	if any(len(difference) > 0 for difference in differences.values()):
+		raise SystemExit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,92 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# This script checks `build_metrics_cube()` on small cumulative tables where the two datasets do not cover
+# the same years: the charging points go up to 2026 and start in 2021, the vehicles go from 2020 to 2025.
+#
+# The cumulative values of a dataset must keep their last total after its last year, and count 0 before its first year.
+# The changes since the previous year are also checked when the years of the cube have a gap (2018, then 2020).
+# The tables are written in a temporary `data` folder, the real files are not touched.
+#
+# Usage: python check_metrics_cube.py
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import tempfile
+
+import pandas as pd
+
+from metrics_cube import build_metrics_cube, load_values, EPOINTS_CUMSUM, EVS_CUMSUM, NATIONAL_CODE
+
+
+EPOINTS_CUM = pd.DataFrame({
+	'dept_code': ['01', '2A'], 'dept_name': ['Ain', 'Corse-du-Sud'],
+	'2021': [10, 1], '2022': [20, 2], '2023': [30, 3], '2024': [40, 4], '2025': [50, 5], '2026': [60, 6],
+})
+EVS_CUM = pd.DataFrame({
+	'dept_code': ['01', '75'], 'dept_name': ['Ain', 'Paris'],
+	'2020': [100, 1000], '2021': [200, 2000], '2022': [300, 3000], '2023': [400, 4000], '2024': [500, 5000], '2025': [600, 6000],
+})
+
+# (dept_code, year) -> expected values
+EXPECTED = {
+	('01', '2020'): {'epoints': 0, 'evs': 100, 'ratio': 0, 'delta_epoints': 0, 'delta_evs': 100},
+	('01', '2021'): {'epoints': 10, 'evs': 200, 'ratio': 20, 'delta_epoints': 10, 'delta_evs': 100},
+	('01', '2026'): {'epoints': 60, 'evs': 600, 'ratio': 10, 'delta_epoints': 10, 'delta_evs': 0, 'delta_ratio': -2},
+	('2A', '2026'): {'epoints': 6, 'evs': 0, 'ratio': 0, 'delta_epoints': 1, 'delta_evs': 0},
+	('75', '2026'): {'epoints': 0, 'evs': 6000, 'ratio': 0, 'delta_epoints': 0, 'delta_evs': 0},
+	(NATIONAL_CODE, '2026'): {'epoints': 66, 'evs': 6600, 'ratio': 100, 'delta_epoints': 11, 'delta_evs': 0},
+}
+
+
+# Vehicles in 2018, then from 2020: 2019 is in neither dataset
+EVS_CUM_GAP = pd.DataFrame({'dept_code': ['01'], 'dept_name': ['Ain'], '2018': [50], '2020': [100], '2021': [200]})
+EPOINTS_CUM_GAP = pd.DataFrame({'dept_code': ['01'], 'dept_name': ['Ain'], '2020': [10], '2021': [20]})
+EXPECTED_GAP = {
+	('01', '2018'): {'evs': 50, 'delta_evs': 50},
+	('01', '2020'): {'evs': 100, 'delta_evs': 50, 'epoints': 10, 'delta_epoints': 10},
+	('01', '2021'): {'evs': 200, 'delta_evs': 100, 'delta_ratio': 0},
+}
+
+
+def compare(cube, expected):
+	errors = []
+	for key, values in expected.items():
+		for column, value in values.items():
+			if cube.loc[key, column] != value:
+				errors.append(f'{key} {column}: {cube.loc[key, column]} instead of {value}')
+	return errors
+
+
+def check_cube(epoints_cum=EPOINTS_CUM, evs_cum=EVS_CUM):
+	with tempfile.TemporaryDirectory() as directory:
+		cwd = os.getcwd()
+		os.chdir(directory)
+		try:
+			os.makedirs('data')
+			epoints_cum.to_csv(EPOINTS_CUMSUM, index=False)
+			evs_cum.to_csv(EVS_CUMSUM, index=False)
+			years, _, _, _, ratio_cum = load_values()
+			cube = build_metrics_cube().set_index(['dept_code', 'year'])
+		finally:
+			os.chdir(cwd)
+
+	return years, ratio_cum, cube
+
+
+def main():
+	years, ratio_cum, cube = check_cube()
+	errors = compare(cube, EXPECTED)
+	if years != [str(year) for year in range(2020, 2027)]:
+		errors.append(f'years: {years}')
+	if ratio_cum.loc['01', '2026'] != 10:
+		errors.append(f'ratio_cum 01 2026: {ratio_cum.loc["01", "2026"]}')
+	_, _, cube = check_cube(EPOINTS_CUM_GAP, EVS_CUM_GAP)
+	errors += compare(cube, EXPECTED_GAP)
+	print(f'Metrics cube: `{len(errors)}` error(s)')
+	for error in errors:
+		print(f'- {error}')
+	if errors:
+		raise SystemExit(1)
+
+
+if __name__ == '__main__':
+	main()
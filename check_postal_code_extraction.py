@@ -0,0 +1,58 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# This script checks the vectorized `extract_postal_code_from_str()` against the row by row `find_postal_code()`
+# on the real dataset `data/charging_points.csv` and compares the timings of both.
+#
+# The only expected differences are the addresses where the legacy version picked 5 digits out of a longer
+# digit run (SIRET, phone number, ...), those are reported separately from the unexpected ones.
+#
+# Usage: python check_postal_code_extraction.py
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import time
+
+from epoints_preprocess import load_dataset, find_postal_code, extract_postal_code_from_str
+
+
+def compare_extraction(df):
+	start = time.perf_counter()
+	legacy = df['adresse_station'].apply(lambda s: find_postal_code(s) if isinstance(s, str) else None)
+	legacy_time = time.perf_counter() - start
+
+	start = time.perf_counter()
+	vectorized = extract_postal_code_from_str(df[['adresse_station']].copy())['postal_code']
+	vectorized_time = time.perf_counter() - start
+
+	mask_diff = legacy.fillna('') != vectorized.fillna('')
+	# The legacy window was part of a longer digit run
+	mask_long_run = df['adresse_station'].str.contains(r'[0-9]{6,}', na=False)
+
+	comparison = df[['adresse_station']].assign(legacy=legacy, vectorized=vectorized)
+
+	return {
+		'rows': len(df),
+		'legacy_time': legacy_time,
+		'vectorized_time': vectorized_time,
+		'identical': int((~mask_diff).sum()),
+		'expected_diff': comparison[mask_diff & mask_long_run],
+		'unexpected_diff': comparison[mask_diff & ~mask_long_run],
+	}
+
+
+def main():
+	df = load_dataset()
+	result = compare_extraction(df)
+
+	print(f'Rows: `{result["rows"]}`, identical: `{result["identical"]}`')
+	print(f'Legacy `find_postal_code`: {result["legacy_time"]:.3f}s, vectorized `extract_postal_code_from_str`: {result["vectorized_time"]:.3f}s '
+		f'(x{result["legacy_time"] / max(result["vectorized_time"], 1e-9):.1f})')
+	print(f'Expected differences (longer digit runs rejected): `{len(result["expected_diff"])}`')
+	if len(result['expected_diff']) > 0:
+		print(result['expected_diff'].head(20).to_string())
+	print(f'Unexpected differences: `{len(result["unexpected_diff"])}`')
+	if len(result['unexpected_diff']) > 0:
+		print(result['unexpected_diff'].head(20).to_string())
+		raise SystemExit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,207 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Data quality report of the source datasets, written to `data/quality/<dataset>.json` and `.html` without Streamlit.
+#
+# For every column the number of missing values, and for the columns listed in the checks of the dataset
+# (`EPOINTS_CHECKS`, `EVS_CHECKS`) the number of rows failing each check, with a few examples of their values:
+# - invalid postal codes (not made of 5 digits)
+# - GPS coordinates which cannot be read, out of the valid range, or outside of the map (`BOUNDS` of `station_bins.py`)
+# - dates which cannot be read as ISO 8601 dates (`created_at`, `DATE_ARRETE`)
+# - rows dropped by the department filter of `adding_department()` (same department resolution, see `dept_index.py`)
+#
+# The checks are vectorized and run on the frames the preprocessing scripts already have in memory, or chunk by chunk
+# in the streaming mode (`profile_chunks()`): the reports of the chunks are added up, no copy of the data is kept.
+# The checks whose column is not in the frame are left out (e.g. `postal_code` on the raw `charging_points.csv`).
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import json
+import html
+import argparse
+import numpy as np
+import pandas as pd
+from dimensions import coordinates
+from dept_index import postal_dept_codes, insee_dept_codes
+from station_bins import BOUNDS
+from instrumentation import profiled
+
+
+QUALITY_DIR = 'data/quality'
+MAX_EXAMPLES = 5
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# CHECKS
+# Each check function takes the values of a column and returns {check name: (description, mask of the failing rows)}
+
+# `func` once per distinct value of a categorical column, then taken for every row by the categorical codes
+def per_distinct_value(values, func):
+	if not isinstance(values.dtype, pd.CategoricalDtype):
+		return func(values).to_numpy(dtype=bool)
+	mask = func(pd.Series(values.cat.categories.astype(str), dtype=object)).to_numpy(dtype=bool)
+	codes = values.cat.codes.to_numpy()
+	return np.where(codes >= 0, mask[codes], False)
+
+def postal_code_checks(values):
+	invalid = per_distinct_value(values, lambda codes: ~codes.astype(str).str.fullmatch(r'[0-9]{5}'))
+	return {'invalid_postal_code': ('Postal code not made of 5 digits', values.notnull().to_numpy() & invalid)}
+
+def coordinate_checks(values):
+	lon, lat = coordinates(values)
+	lon, lat = lon.to_numpy(), lat.to_numpy()
+	parsed = ~np.isnan(lon) & ~np.isnan(lat)
+	in_range = (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+	(lat_min, lon_min), (lat_max, lon_max) = BOUNDS
+	on_map = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+	return {
+		'unreadable_coordinates': ('GPS coordinates which cannot be read', values.notnull().to_numpy() & ~parsed),
+		'out_of_range_coordinates': ('Latitude out of [-90, 90] or longitude out of [-180, 180]', parsed & ~in_range),
+		'outside_map_coordinates': ('Valid coordinates outside of the map (overseas, swapped, ...)', parsed & in_range & ~on_map),
+	}
+
+# The whole value is read (ISO 8601, with or without the time), not only its year: `2023-13-45` or `2023garbage` fail
+def date_checks(values):
+	invalid = per_distinct_value(values, lambda dates: pd.to_datetime(dates, errors='coerce', format='ISO8601', utc=True).isna())
+	return {'unreadable_date': ('Date which cannot be read (not an ISO 8601 date)', values.notnull().to_numpy() & invalid)}
+
+def postal_department_checks(values):
+	return {'no_department': ('Dropped by the department filter (postal code)', postal_dept_codes(values).isnull().to_numpy())}
+
+def commune_department_checks(values):
+	return {'no_department': ('Dropped by the department filter (commune code)', insee_dept_codes(values).isnull().to_numpy())}
+
+# Column -> check function, with the column names used by the preprocessing scripts
+EPOINTS_CHECKS = {
+	'consolidated_code_postal': postal_code_checks,
+	'coordonneesXY': coordinate_checks,
+	'created_at': date_checks,
+	# Resolved by `process_missing_postal_codes()`, not in the raw file
+	'postal_code': postal_department_checks,
+}
+
+EVS_CHECKS = {
+	'date_arrete': date_checks,
+	'codgeo': commune_department_checks,
+}
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# REPORTS
+# {'dataset', 'rows', 'missing': {column: rows}, 'checks': {name: {'column', 'description', 'rows', 'examples'}}}
+
+# The checks of `checks` whose column is in `df`
+def run_checks(df, checks):
+	results = {}
+	for column, check in checks.items():
+		if column not in df.columns:
+			continue
+		values = df[column]
+		for name, (description, mask) in check(values).items():
+			examples = values[mask].iloc[:1000].dropna().astype(str).unique()[:MAX_EXAMPLES]
+			results[name] = {'column': column, 'description': description, 'rows': int(mask.sum()), 'examples': list(examples)}
+	return results
+
+@profiled()
+def profile_frame(df, checks, dataset):
+	return {
+		'dataset': dataset,
+		'rows': len(df),
+		'missing': {column: int(count) for column, count in df.isna().sum().items()},
+		'checks': run_checks(df, checks),
+	}
+
+# Report of `charging_points.csv` (`epoints`), the department filter is checked on the postal codes resolved by
+# `process_missing_postal_codes()` (`resolved`, the same rows)
+def epoints_report(epoints, resolved):
+	report = profile_frame(epoints, EPOINTS_CHECKS, 'charging_points')
+	report['checks'].update(run_checks(resolved[['postal_code']], EPOINTS_CHECKS))
+	return report
+
+# Report of two parts of the same dataset (chunks)
+def add_reports(report, other):
+	if report is None:
+		return other
+	missing = {column: report['missing'].get(column, 0) + other['missing'].get(column, 0) for column in {**report['missing'], **other['missing']}}
+	checks = {}
+	for name in {**report['checks'], **other['checks']}:
+		first, second = report['checks'].get(name), other['checks'].get(name)
+		if first is None or second is None:
+			checks[name] = first or second
+			continue
+		examples = list(dict.fromkeys(first['examples'] + second['examples']))[:MAX_EXAMPLES]
+		checks[name] = {**first, 'rows': first['rows'] + second['rows'], 'examples': examples}
+	return {'dataset': report['dataset'], 'rows': report['rows'] + other['rows'], 'missing': missing, 'checks': checks}
+
+# Passing the chunks through, their reports are added up in `report['report']` as they are read
+def profile_chunks(chunks, checks, dataset, report):
+	report['report'] = None
+	for chunk in chunks:
+		report['report'] = add_reports(report['report'], profile_frame(chunk, checks, dataset))
+		yield chunk
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# One row per column (missing values) and per check, the rows with a problem first
+def report_table(report):
+	rows = [{'check': 'missing', 'column': column, 'description': 'Missing value', 'rows': count, 'examples': ''}
+		for column, count in report['missing'].items()]
+	rows += [{'check': name, 'column': check['column'], 'description': check['description'], 'rows': check['rows'],
+		'examples': ', '.join(check['examples'])} for name, check in report['checks'].items()]
+	table = pd.DataFrame(rows, columns=['check', 'column', 'description', 'rows', 'examples'])
+	table['share'] = (table['rows'] / max(report['rows'], 1)).round(4)
+	return table.sort_values('rows', ascending=False, kind='stable').reset_index(drop=True)
+
+# Rows with a problem in RED, without problem in GREEN
+def report_html(report):
+	table = report_table(report)
+	lines = [f'<tr style="color: {"red" if row.rows > 0 else "green"}">' + ''.join(f'<td>{html.escape(str(value))}</td>' for value in row)
+		+ '</tr>' for row in table.itertuples(index=False)]
+	header = ''.join(f'<th>{column}</th>' for column in table.columns)
+	return (f'<html><head><meta charset="utf-8"><title>Data quality: {html.escape(report["dataset"])}</title></head><body>'
+		f'<h1>Data quality: {html.escape(report["dataset"])}</h1><p>{report["rows"]:,} rows</p>'
+		f'<table border="1" cellpadding="4"><tr>{header}</tr>{"".join(lines)}</table></body></html>')
+
+def save_report(report, directory=QUALITY_DIR):
+	os.makedirs(directory, exist_ok=True)
+	path = os.path.join(directory, report['dataset'])
+	with open(path + '.json', 'w') as f:
+		json.dump(report, f, indent=1, ensure_ascii=False)
+	with open(path + '.html', 'w') as f:
+		f.write(report_html(report))
+	failing = sum(check['rows'] > 0 for check in report['checks'].values())
+	print(f'The data quality report has been saved to `{path}.json` and `{path}.html` ({failing} check(s) with failing rows)')
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# The source files alone, read whole from the Parquet cache or by chunks of `chunksize` rows
+def profile_epoints(chunksize=None):
+	from ingest import read_csv_chunks, EPOINTS_SPEC
+	from epoints_preprocess import load_dataset
+	chunks = read_csv_chunks('data/charging_points.csv', EPOINTS_SPEC, chunksize) if chunksize else [load_dataset()]
+	report = {}
+	for _ in profile_chunks(chunks, EPOINTS_CHECKS, 'charging_points', report):
+		pass
+	return report['report']
+
+def profile_evs(chunksize=None):
+	from vehicles_preprocess import load_dataset, load_dataset_chunks
+	chunks = load_dataset_chunks(chunksize) if chunksize else [load_dataset()]
+	report = {}
+	for _ in profile_chunks(chunks, EVS_CHECKS, 'voitures', report):
+		pass
+	return report['report']
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Data quality reports of `charging_points.csv` and `voitures.csv` in `data/quality/`')
+	parser.add_argument('datasets', nargs='*', help='Datasets to profile, `epoints` and / or `evs` (default: both)')
+	parser.add_argument('--chunksize', type=int, help='Read the source files by chunks of this many rows')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	datasets = args.datasets or ['epoints', 'evs']
+	unknown = [dataset for dataset in datasets if dataset not in ['epoints', 'evs']]
+	if unknown:
+		raise SystemExit(f'Unknown dataset(s) {unknown}, expected `epoints` and / or `evs`')
+	for dataset in datasets:
+		save_report(profile_epoints(args.chunksize) if dataset == 'epoints' else profile_evs(args.chunksize))
+
+
+if __name__ == '__main__':
+	main()
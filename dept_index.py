@@ -0,0 +1,137 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Prebuilt lookup index of the department of every French postal code, shared by both preprocessing scripts.
+#
+# Built once from the reference files (`code-postal-corse.csv`, `fr-ref-geo.csv`) into `data/dept_index/`:
+# - `postal_dept.v<version>.npy`: for each of the 100,000 codes 00000-99999, the position of its department
+#	in `DEPT_LABELS` (int8, -1 when unknown):
+#	- 01xxx-95xxx: the first 2 digits
+#	- 20xxx (Corsica): 2A or 2B from `code-postal-corse.csv`, unknown if the code is not listed
+#	- 97xxx, 98xxx (overseas): the first 3 digits (971 Guadeloupe ... 976 Mayotte, 975, 977, 978, 98x)
+#	- 00xxx, 96xxx, 99xxx: unknown
+# - `dept_index.v<version>.json`: the labels, the department names (`fr-ref-geo.csv`) and the stamps of the sources
+#
+# The index is rebuilt when `INDEX_VERSION` or one of the sources changes. It is loaded once per process (the array
+# is memory-mapped) and applied to the distinct values of a categorical column only (see `dept_codes_from()`).
+# The overseas departments are resolved but are not in `DEPT_CODES`, so they are dropped like before.
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import json
+import functools
+import numpy as np
+import pandas as pd
+from dimensions import DEPT_CODES, dept_codes_from
+
+
+INDEX_VERSION = 1
+INDEX_DIR = 'data/dept_index'
+CORSICA_SOURCE = 'data/code-postal-corse.csv'
+NAMES_SOURCE = 'data/fr-ref-geo.csv'
+OVERSEAS_CODES = ['971', '972', '973', '974', '975', '976', '977', '978', '984', '986', '987', '988']
+DEPT_LABELS = DEPT_CODES + OVERSEAS_CODES
+
+def index_paths(directory=INDEX_DIR):
+	return (os.path.join(directory, f'postal_dept.v{INDEX_VERSION}.npy'),
+		os.path.join(directory, f'dept_index.v{INDEX_VERSION}.json'))
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Size and modification time of the sources, to know when the index is stale
+def source_stamps():
+	return {path: [os.path.getsize(path), os.path.getmtime(path)] for path in [CORSICA_SOURCE, NAMES_SOURCE]}
+
+def build_postal_dept():
+	codes = np.arange(100000)
+	labels = pd.Series(np.arange(len(DEPT_LABELS)), index=DEPT_LABELS)
+	postal_dept = np.full(len(codes), -1, dtype=np.int8)
+
+	# Mainland: the first 2 digits
+	prefix = codes // 1000
+	mainland = (prefix >= 1) & (prefix <= 95) & (prefix != 20)
+	postal_dept[mainland] = labels.reindex([str(p).zfill(2) for p in prefix[mainland]]).to_numpy()
+
+	# Overseas: the first 3 digits, when they are a known department / collectivity
+	overseas = (prefix == 97) | (prefix == 98)
+	positions = labels.reindex((codes[overseas] // 100).astype(str)).to_numpy()
+	postal_dept[overseas] = np.where(np.isnan(positions), -1, positions)
+
+	# Corsica: the postal codes listed in `code-postal-corse.csv` (the last row wins if a code is listed twice)
+	df_corse = pd.read_csv(CORSICA_SOURCE, sep=';', dtype=str)
+	df_corse = df_corse[df_corse['Code_postal'].str.fullmatch(r'20[0-9]{3}', na=False) & df_corse['CODE_DEPT'].isin(['2A', '2B'])]
+	df_corse = df_corse.drop_duplicates(subset='Code_postal', keep='last')
+	postal_dept[df_corse['Code_postal'].astype(int).to_numpy()] = labels[df_corse['CODE_DEPT']].to_numpy()
+	return postal_dept
+
+def build_index(directory=INDEX_DIR):
+	df_fr_dep = pd.read_csv(NAMES_SOURCE, sep=';', dtype=str)
+	dep_to_name = df_fr_dep.set_index('DEP_CODE')['DEP_NOM'].to_dict()
+	meta = {
+		'version': INDEX_VERSION,
+		'labels': DEPT_LABELS,
+		'names': {code: name for code, name in dep_to_name.items() if isinstance(name, str)},
+		'sources': source_stamps(),
+	}
+
+	# Written to temporary files then renamed, the stages of `pipeline.py` may build it at the same time
+	array_path, meta_path = index_paths(directory)
+	os.makedirs(directory, exist_ok=True)
+	suffix = f'.{os.getpid()}.tmp'
+	with open(array_path + suffix, 'wb') as f:
+		np.save(f, build_postal_dept())
+	with open(meta_path + suffix, 'w') as f:
+		json.dump(meta, f, ensure_ascii=False)
+	os.replace(array_path + suffix, array_path)
+	os.replace(meta_path + suffix, meta_path)
+	print(f'The postal code index has been saved to `{array_path}`')
+
+def is_up_to_date(directory=INDEX_DIR):
+	array_path, meta_path = index_paths(directory)
+	if not (os.path.exists(array_path) and os.path.exists(meta_path)):
+		return False
+	with open(meta_path) as f:
+		meta = json.load(f)
+	return meta.get('version') == INDEX_VERSION and meta.get('labels') == DEPT_LABELS and meta.get('sources') == source_stamps()
+
+# Built first if missing or stale, the stamps of the sources are part of the cache key
+@functools.lru_cache(maxsize=4)
+def _load_index(directory, stamps):
+	if not is_up_to_date(directory):
+		build_index(directory)
+	array_path, meta_path = index_paths(directory)
+	with open(meta_path) as f:
+		meta = json.load(f)
+	return np.load(array_path, mmap_mode='r'), meta['names']
+
+# (postal code -> position in `DEPT_LABELS` array, department code -> name dict), loaded once per process
+def load_index(directory=INDEX_DIR):
+	return _load_index(os.path.abspath(directory), json.dumps(source_stamps()))
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Categorical `dept_code` of a column of postal codes, the index is applied once per distinct postal code.
+# The 5 digits codes are looked up in the index, anything else keeps the rule of the first 2 characters (e.g. '2A004')
+def postal_dept_codes(values):
+	postal_dept, _ = load_index()
+	# The position -1 (unknown) picks the last label, `None`
+	labels = np.array(DEPT_LABELS + [None], dtype=object)
+
+	def postal_code_to_dept(codes):
+		dept = codes.str[:2]
+		is_postal_code = codes.str.fullmatch(r'[0-9]{5}')
+		dept[is_postal_code] = labels[postal_dept[codes[is_postal_code].astype(int).to_numpy()]]
+		return dept
+	return dept_codes_from(values, postal_code_to_dept)
+
+# Categorical `dept_code` of a column of INSEE commune codes (`CODGEO`): Corsica is already 2A / 2B in these codes,
+# the overseas communes start with the 3 digits of their department (97101, ...)
+def insee_dept_codes(values):
+	def insee_code_to_dept(codes):
+		prefix = codes.str[:2]
+		return prefix.where(~prefix.isin(['97', '98']), codes.str[:3])
+	return dept_codes_from(values, insee_code_to_dept)
+
+# Department code -> department name (`fr-ref-geo.csv`), from the index
+def dept_names_map():
+	return load_index()[1]
+
+
+if __name__ == '__main__':
+	build_index()
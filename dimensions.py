@@ -0,0 +1,144 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Compact representation of the keys shared by both preprocessing scripts:
+# - `dept_code`: categorical with a fixed list of categories `DEPT_CODES` (01-95 + 2A + 2B, in the string order),
+#	anything else ('20', '00', '', ...) is missing. The tables of both datasets use the same integer codes.
+# - `dept_name`: categorical, its categories follow the order of `DEPT_CODES`
+# - `year`: small integer `YEAR_DTYPE` (nullable, <NA> when the date cannot be read)
+# - `postal_code`: categorical (about 6,000 distinct codes for hundreds of thousands of rows)
+# - `lon`, `lat`: floats parsed from the GPS coordinates strings `[lon, lat]`
+#
+# The keys derived from a categorical column are computed once per distinct value of the column,
+# then taken for every row by their integer codes.
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import numpy as np
+import pandas as pd
+
+
+DEPT_CODES = sorted([str(i).zfill(2) for i in range(1, 96) if i != 20] + ['2A', '2B'])
+DEPT_DTYPE = pd.CategoricalDtype(DEPT_CODES)
+YEAR_DTYPE = 'Int16'
+# Vehicles per commune and year, one Parquet file per department: written by `vehicles_preprocess.py`, read by the dashboard
+COMMUNES_DIR = 'data/communes'
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Categorical `dept_code`, the values which are not a department code are missing
+def dept_codes(values):
+	return pd.Series(pd.Categorical(values, dtype=DEPT_DTYPE), index=values.index, name='dept_code')
+
+# Categorical `dept_code` of a low cardinality column (postal codes, CODGEO, ...), `func` maps its distinct values
+# to department codes
+def dept_codes_from(values, func):
+	values = values.astype('category')
+	depts = dept_codes(func(pd.Series(values.cat.categories.astype(str), dtype=object))).cat.codes.to_numpy()
+	codes = values.cat.codes.to_numpy()
+	dept = np.where(codes >= 0, depts[codes], -1)
+	return pd.Series(pd.Categorical.from_codes(dept, dtype=DEPT_DTYPE), index=values.index, name='dept_code')
+
+# Categorical `dept_name` of a `dept_code` column, missing for the codes not in `dep_to_name`
+def dept_names(dept_code, dep_to_name):
+	names = [dep_to_name.get(code) for code in DEPT_CODES]
+	categories = list(dict.fromkeys(name for name in names if isinstance(name, str)))
+	name_codes = np.array([categories.index(name) if isinstance(name, str) else -1 for name in names])
+	codes = dept_code.cat.codes.to_numpy()
+	names = np.where(codes >= 0, name_codes[codes], -1)
+	return pd.Series(pd.Categorical.from_codes(names, categories=categories), index=dept_code.index, name='dept_name')
+
+# Year of ISO dates ('2023-05-12T10:00:00+00:00', '2024-03-31') or of years already read
+def years(dates):
+	if pd.api.types.is_numeric_dtype(dates):
+		return dates.astype(YEAR_DTYPE)
+	if isinstance(dates.dtype, pd.CategoricalDtype):
+		# Once per distinct date, then taken for every row by the categorical codes
+		category_years = years(pd.Series(dates.cat.categories.astype(str))).to_numpy(dtype=float, na_value=np.nan)
+		codes = dates.cat.codes.to_numpy()
+		return pd.Series(np.where(codes >= 0, category_years[codes], np.nan), index=dates.index).astype(YEAR_DTYPE)
+	return pd.to_numeric(dates.str.slice(0, 4), errors='coerce').astype(YEAR_DTYPE)
+
+# Postal codes as a categorical of strings, the missing values are kept
+def postal_codes(values):
+	return values.where(values.isnull(), values.astype(str)).astype('category')
+
+# GPS coordinates `[lon, lat]` (e.g. `[-0.056488 , 48.723084]`, the brackets are optional)
+COORDINATES_PATTERN = r'^\s*\[?\s*([-+0-9.eE]+)\s*,\s*([-+0-9.eE]+)\s*\]?\s*$'
+
+# Float `lon` and `lat` of GPS coordinates strings, NaN when they cannot be read
+def coordinates(values):
+	coords = values.str.extract(COORDINATES_PATTERN)
+	return pd.to_numeric(coords[0], errors='coerce'), pd.to_numeric(coords[1], errors='coerce')
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# AGGREGATION KERNEL
+# Dense key x year matrix of the number of rows (or of the sum of `values`), with a single `np.bincount`
+# over the integer codes `key * n_years + (year - first_year)`. The years go from the first to the last one found
+# in the data, a year without any row is a column of 0. The rows without key (code -1) or year are left out,
+# the missing `values` count 0. Returns the matrix (int64, one row per key code `0..n_keys - 1`), the years and the observed keys
+def code_year_matrix(codes, n_keys, year, values=None):
+	year = year.to_numpy(dtype=float, na_value=np.nan)
+	mask = (codes >= 0) & ~np.isnan(year)
+	if not mask.any():
+		return np.zeros((n_keys, 0), dtype=np.int64), [], np.zeros(n_keys, dtype=bool)
+
+	codes = codes[mask].astype(np.int64)
+	year = year[mask].astype(np.int64)
+	first_year, last_year = year.min(), year.max()
+	n_years = last_year - first_year + 1
+	flat = codes * n_years + (year - first_year)
+	size = n_keys * n_years
+
+	if values is None:
+		matrix = np.bincount(flat, minlength=size)
+	else:
+		weights = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=0)[mask]
+		matrix = np.rint(np.bincount(flat, weights=weights, minlength=size)).astype(np.int64)
+	observed = np.bincount(codes, minlength=n_keys) > 0
+	return matrix.reshape(n_keys, n_years), [str(y) for y in range(first_year, last_year + 1)], observed
+
+# Same, one row per `DEPT_CODES`
+def dept_year_matrix(dept_code, year, values=None):
+	return code_year_matrix(dept_code.cat.codes.to_numpy(), len(DEPT_CODES), year, values)
+
+# Pivot table indexed by (`dept_code`, `dept_name`) with one column per year and the `total` column, from the rows of `df`
+# (columns `dept_code`, `dept_name`, `year` and `values` if given). Only the observed departments with a name are kept
+def pivot_dept_year(df, values=None):
+	matrix, year_columns, observed = dept_year_matrix(df['dept_code'], df['year'], None if values is None else df[values])
+
+	# The name of each department, as found in the data
+	codes = df['dept_code'].cat.codes.to_numpy()
+	names = np.full(len(DEPT_CODES), None, dtype=object)
+	mask = codes >= 0
+	names[codes[mask]] = df['dept_name'].to_numpy(dtype=object)[mask]
+	keep = observed & pd.notnull(names)
+
+	index = pd.MultiIndex.from_arrays([np.array(DEPT_CODES, dtype=object)[keep], names[keep]], names=['dept_code', 'dept_name'])
+	pivot_df = pd.DataFrame(matrix[keep], index=index, columns=pd.Index(year_columns, name='year'))
+	return add_total(pivot_df)
+
+# The columns of the years of a pivot table (every column but `total`)
+def year_columns(pivot_df):
+	return [column for column in pivot_df.columns if column != 'total']
+
+# `total` over all the years of a pivot table
+def add_total(pivot_df):
+	pivot_df['total'] = pivot_df[year_columns(pivot_df)].sum(axis=1)
+	return pivot_df
+
+# Cumulative sum over the years of a pivot table
+def cumsum_pivot(pivot_df):
+	return pivot_df[year_columns(pivot_df)].cumsum(axis=1)
+
+# A cumulative pivot table (see `cumsum_pivot()`) on other departments and years: a year after the last one of the
+# table keeps the value of the last year before it (the total so far), a year before the first one and a missing
+# department count 0
+def align_cumsum(cum_df, index, years):
+	columns = sorted(set(cum_df.columns) | set(years), key=int)
+	aligned = cum_df.reindex(index=index, columns=columns).ffill(axis=1).fillna(0)
+	return aligned[list(years)].astype(np.int64)
+
+# Adding the missing years between the first and the last year of a pivot table (columns of 0), in order
+def fill_years(pivot_df):
+	years = [int(column) for column in year_columns(pivot_df)]
+	if not years:
+		return pivot_df
+	columns = [str(y) for y in range(min(years), max(years) + 1)]
+	return pivot_df[year_columns(pivot_df)].reindex(columns=columns, fill_value=0)
@@ -4,223 +4,94 @@
 # Therefore, the missing postal codes in the dataset need to be filled in.
 #
 # Steps to preprocess the dataset:
-# 1. Load the datasets (charging_points.csv, fr-ref-geo.csv) `load_dataset()` -> (epoints, geo_ref) and examin the data `display_missing_values()`
+# 1. Load the datasets (charging_points.csv, fr-ref-geo.csv) `load_dataset()` -> (epoints, geo_ref) and examin the data `epoints_report()` (data quality report `data/quality/charging_points.json`, see `data_quality.py`)
 # 2. Isolate the columns needed for the preprocessing `select_columns()` (the goal to fill in the missing postal codes)
 # 3. Process the missing postal codes `process_missing_postal_codes()`:
 #	- Extract postal code from `adresse_station` string and store it in `postal_code`, new column `extract_postal_code_from_str()`
+#	  (this step and the parsing of the GPS coordinates can run on several processes, `--workers`)
 # 	- Fill in the postal code based on similar GPS coordinates in new `lat_lon` column `map_coordinates_to_postal_code()`
+#	  (same `lat_lon` cell first, then the nearest location with a known postal code)
 #	- Some manual fixes (about 600 rows with around 150 unique locations) for the remaining missing postal codes `postal_code_manual_fixes()`
+#	  (the overrides are kept in `data/postal_code_overrides.csv`, keyed by `lat_lon`)
 # 4. Grouping the dataset by department in `adding_department()`
-#	- Fixing the postal codes for Corsica (20) to 2A and 2B`
+#	- Department of each postal code from the prebuilt index `dept_index.py` (Corsica (20) resolved to 2A and 2B)
 #	- Drop the rows with empty `department` values as well as all that is not in the range of 1-95 + 2A + 2B
 #	- Mappping the department codes to department names `dep_to_name`
 #	- Saving dataset with following columns: ('dept_code', 'dept_name', 'year')
-# 5. Transforming the dataset into a pivot table withthe follwong columns:
-# 	['dept_code', 'dept_name', '2021', '2022', '2023', '2024', 'total']
-
-import streamlit as st
+#	- Hashing the point and station identifiers with the rounded coordinates `hash_keys()` (`point_key`, `station_key`)
+# 5. Transforming the dataset into a pivot table withthe follwong columns (counting the rows, the distinct points or the distinct stations, `--count`):
+# 	['dept_code', 'dept_name', <one column per year, from the first to the last year of `created_at`>, 'total']
+# 6. Counting the charging points in the cells of the density grid shown on the map `data/station_bins.npz` (see `station_bins.py`)
+
+import os
+import re
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from unidecode import unidecode
-
+import pyarrow.parquet as pq
+from ingest import load_cached_csv, EPOINTS_SPEC
+from metrics_cube import update_metrics_cube
+from dept_index import postal_dept_codes, dept_names_map
+from station_bins import build_station_bins, save_station_bins
+from data_quality import epoints_report, report_table, save_report
+from dimensions import DEPT_DTYPE, DEPT_CODES, dept_names, years, postal_codes, coordinates, pivot_dept_year, add_total, cumsum_pivot, fill_years
+from instrumentation import profiled, enable, run_profiled, add_profile_argument, debug_panel, in_streamlit
 
-st.set_page_config(
-	page_title="Data Clean",
-	layout="wide",
-)
 
 # @st.cache_data
+# Only the columns needed for the preprocessing are loaded, from the Parquet cache (see `ingest.py`)
+@profiled()
 def load_dataset():
-	epoints = pd.read_csv('data/charging_points.csv', dtype=str)
+	epoints = load_cached_csv('data/charging_points.csv', EPOINTS_SPEC)
 	return epoints
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-def postal_code_manual_fixes(df):
-	# Fill in the missing postal codes manually based GPS coordinates `coordonneesXY`
-	df.loc[df['lat_lon'] == '43.95, 4.76', 'postal_code'] = '30133'
-	df.loc[df['lat_lon'] == '43.96, 4.75', 'postal_code'] = '30133'
-	df.loc[df['lat_lon'] == '44.02, 4.79', 'postal_code'] = '30150'
-	df.loc[df['lat_lon'] == '47.50, 0.49', 'postal_code'] = '37360'
-	df.loc[df['lat_lon'] == '48.79, 2.15', 'postal_code'] = '78000'
-	df.loc[df['lat_lon'] == '48.80, 2.15', 'postal_code'] = '78000'
-	df.loc[df['lat_lon'] == '43.33, 6.54', 'postal_code'] = '83120'
-	df.loc[df['lat_lon'] == '43.32, 6.62', 'postal_code'] = '83120'
-	df.loc[df['lat_lon'] == '43.27, 6.52', 'postal_code'] = '83310'
-	df.loc[df['lat_lon'] == '43.22, 6.66', 'postal_code'] = '83350'
-	df.loc[df['lat_lon'] == '43.23, 6.58', 'postal_code'] = '83580'
-	df.loc[df['lat_lon'] == '43.26, 6.58', 'postal_code'] = '83580'
-	df.loc[df['lat_lon'] == '43.27, 6.63', 'postal_code'] = '83990'
-	df.loc[df['lat_lon'] == '43.95, 4.83', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.92, 4.82', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.93, 4.79', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.93, 4.80', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.92, 4.81', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.94, 4.87', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.94, 4.82', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.94, 4.79', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.94, 4.84', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.95, 4.79', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.95, 4.82', 'postal_code'] = '84000'
-	df.loc[df['lat_lon'] == '43.94, 4.89', 'postal_code'] = '84310'
-	df.loc[df['lat_lon'] == '43.82, 5.40', 'postal_code'] = '84400'
-	df.loc[df['lat_lon'] == '43.94, 4.93', 'postal_code'] = '84470'
-	df.loc[df['lat_lon'] == '48.79, 2.26', 'postal_code'] = '92140'
-	df.loc[df['lat_lon'] == '48.85, 2.20', 'postal_code'] = '92380'
-	df.loc[df['lat_lon'] == '48.83, 2.18', 'postal_code'] = '92410'
-	df.loc[df['lat_lon'] == '43.92, 4.87', 'postal_code'] = '84140'
-	df.loc[df['lat_lon'] == '48.81, 2.46', 'postal_code'] = '94340'
-	df.loc[df['lat_lon'] == '48.82, 2.47', 'postal_code'] = '94340'
-	df.loc[df['lat_lon'] == '43.53, 5.30', 'postal_code'] = '13122'
-	df.loc[df['lat_lon'] == '43.53, 5.29', 'postal_code'] = '13122'
-	df.loc[df['lat_lon'] == '44.97, 0.43', 'postal_code'] = '24400'
-	df.loc[df['lat_lon'] == '48.34, 1.18', 'postal_code'] = '28120'
-	df.loc[df['lat_lon'] == '47.86, 1.68', 'postal_code'] = '45130'
-	df.loc[df['lat_lon'] == '43.28, 6.58', 'postal_code'] = '83310'
-	df.loc[df['lat_lon'] == '43.28, 6.59', 'postal_code'] = '83310'
-	df.loc[df['lat_lon'] == '43.27, 6.58', 'postal_code'] = '83310'
-	df.loc[df['lat_lon'] == '43.22, 6.65', 'postal_code'] = '83350'
-	df.loc[df['lat_lon'] == '43.25, 6.63', 'postal_code'] = '83350'
-	df.loc[df['lat_lon'] == '43.22, 6.64', 'postal_code'] = '83350'
-	df.loc[df['lat_lon'] == '43.16, 6.46', 'postal_code'] = '83820'
-	df.loc[df['lat_lon'] == '43.93, 4.87', 'postal_code'] = '84140'
-	df.loc[df['lat_lon'] == '43.75, 5.34', 'postal_code'] = '84160'
-	df.loc[df['lat_lon'] == '43.97, 4.90', 'postal_code'] = '84270'
-	df.loc[df['lat_lon'] == '43.98, 4.89', 'postal_code'] = '84270'
-	df.loc[df['lat_lon'] == '44.00, 4.92', 'postal_code'] = '84320'
-	df.loc[df['lat_lon'] == '48.80, 2.26', 'postal_code'] = '92140'
-	df.loc[df['lat_lon'] == '48.78, 2.23', 'postal_code'] = '92140'
-	df.loc[df['lat_lon'] == '48.78, 2.28', 'postal_code'] = '92290'
-	df.loc[df['lat_lon'] == '48.79, 2.27', 'postal_code'] = '92350'
-	df.loc[df['lat_lon'] == '48.77, 2.25', 'postal_code'] = '92290'
-	df.loc[df['lat_lon'] == '48.84, 2.18', 'postal_code'] = '92380'
-	df.loc[df['lat_lon'] == '48.84, 2.19', 'postal_code'] = '92380'
-	df.loc[df['lat_lon'] == '48.77, 2.05', 'postal_code'] = '78180'
-	df.loc[df['lat_lon'] == '48.15, -1.59', 'postal_code'] = '35510'
-	df.loc[df['lat_lon'] == '44.77, 0.40', 'postal_code'] = '24240'
-	df.loc[df['lat_lon'] == '48.38, 4.34', 'postal_code'] = '10220'
-	df.loc[df['lat_lon'] == '46.08, 5.81', 'postal_code'] = '01200'
-	df.loc[df['lat_lon'] == '46.26, 5.36', 'postal_code'] = '01370'
-	df.loc[df['lat_lon'] == '45.46, 4.49', 'postal_code'] = '42400'
-	df.loc[df['lat_lon'] == '4.96, 4.57', 'postal_code'] = '' # error in coords ?!
-	df.loc[df['lat_lon'] == '43.43, 5.51', 'postal_code'] = '13120'
-	df.loc[df['lat_lon'] == '47.17, 1.48', 'postal_code'] = '36600'
-	df.loc[df['lat_lon'] == '43.54, 1.40', 'postal_code'] = '31120'
-	df.loc[df['lat_lon'] == '47.87, -3.93', 'postal_code'] = '29900'
-	df.loc[df['lat_lon'] == '48.53, 2.15', 'postal_code'] = '91580'
-	df.loc[df['lat_lon'] == '48.06, -0.79', 'postal_code'] = '53000'
-	df.loc[df['lat_lon'] == '44.14, 5.06', 'postal_code'] = '84190'
-	df.loc[df['lat_lon'] == '43.14, 5.84', 'postal_code'] = '83190'
-	df.loc[df['lat_lon'] == '43.47, 6.66', 'postal_code'] = '83480'
-	df.loc[df['lat_lon'] == '43.12, 5.83', 'postal_code'] = '83140'
-	df.loc[df['lat_lon'] == '44.14, 4.04', 'postal_code'] = '30480'
-	df.loc[df['lat_lon'] == '50.60, 5.48', 'postal_code'] = '' # Belgium
-	df.loc[df['lat_lon'] == '43.69, 7.22', 'postal_code'] = '06200'
-	df.loc[df['lat_lon'] == '51.01, 2.37', 'postal_code'] = '59180'
-	df.loc[df['lat_lon'] == '46.14, 3.41', 'postal_code'] = '03700'
-	df.loc[df['lat_lon'] == '49.73, 4.75', 'postal_code'] = '08000'
-	df.loc[df['lat_lon'] == '47.80, 7.31', 'postal_code'] = '68270'
-	df.loc[df['lat_lon'] == '46.66, -1.33', 'postal_code'] = '85310'
-	df.loc[df['lat_lon'] == '48.33, 4.11', 'postal_code'] = '10150'
-	df.loc[df['lat_lon'] == '48.30, 4.14', 'postal_code'] = '10410'
-	df.loc[df['lat_lon'] == '50.64, 3.19', 'postal_code'] = '59510'
-	df.loc[df['lat_lon'] == '51.00, 2.33', 'postal_code'] = '59380'
-	df.loc[df['lat_lon'] == '49.86, 4.42', 'postal_code'] = '08260'
-	df.loc[df['lat_lon'] == '49.42, 4.95', 'postal_code'] = '08240'
-	df.loc[df['lat_lon'] == '49.88, 4.84', 'postal_code'] = '08800'
-	df.loc[df['lat_lon'] == '49.35, 4.49', 'postal_code'] = '08310'
-	df.loc[df['lat_lon'] == '49.87, 4.80', 'postal_code'] = '08800'
-	df.loc[df['lat_lon'] == '49.89, 4.62', 'postal_code'] = '08500'
-	df.loc[df['lat_lon'] == '49.52, 4.47', 'postal_code'] = '08300'
-	df.loc[df['lat_lon'] == '49.90, 4.27', 'postal_code'] = '08380'
-	df.loc[df['lat_lon'] == '49.39, 4.69', 'postal_code'] = '08400'
-	df.loc[df['lat_lon'] == '49.85, 4.76', 'postal_code'] = '08120'
-	df.loc[df['lat_lon'] == '49.78, 4.49', 'postal_code'] = '08150'
-	df.loc[df['lat_lon'] == '49.92, 4.52', 'postal_code'] = '08230'
-	df.loc[df['lat_lon'] == '49.51, 4.76', 'postal_code'] = '08390'
-	df.loc[df['lat_lon'] == '49.85, 4.74', 'postal_code'] = '08120'
-	df.loc[df['lat_lon'] == '49.17, 1.35', 'postal_code'] = '27940'
-	df.loc[df['lat_lon'] == '48.94, 0.66', 'postal_code'] = '27410'
-	df.loc[df['lat_lon'] == '49.01, 0.70', 'postal_code'] = '27410'
-	df.loc[df['lat_lon'] == '49.15, 0.67', 'postal_code'] = '27300'
-	df.loc[df['lat_lon'] == '48.89, 0.93', 'postal_code'] = '27160'
-	df.loc[df['lat_lon'] == '48.83, 0.96', 'postal_code'] = '27160'
-	df.loc[df['lat_lon'] == '48.86, 1.07', 'postal_code'] = '27240'
-	df.loc[df['lat_lon'] == '48.87, 1.08', 'postal_code'] = '27240'
-	df.loc[df['lat_lon'] == '49.06, 1.41', 'postal_code'] = '27950'
-	df.loc[df['lat_lon'] == '49.15, 1.60', 'postal_code'] = '27630'
-	df.loc[df['lat_lon'] == '49.19, 1.22', 'postal_code'] = '27400'
-	df.loc[df['lat_lon'] == '49.26, 0.93', 'postal_code'] = '27370'
-	df.loc[df['lat_lon'] == '49.18, 1.54', 'postal_code'] = '27510'
-	df.loc[df['lat_lon'] == '48.75, 1.54', 'postal_code'] = '28410'
-	df.loc[df['lat_lon'] == '48.74, 0.92', 'postal_code'] = '27130'
-	df.loc[df['lat_lon'] == '48.73, 0.92', 'postal_code'] = '27130'
-	df.loc[df['lat_lon'] == '48.97, 0.78', 'postal_code'] = '27190'
-	df.loc[df['lat_lon'] == '49.29, 1.47', 'postal_code'] = '27150'
-	df.loc[df['lat_lon'] == '49.26, 0.97', 'postal_code'] = '27370'
-	df.loc[df['lat_lon'] == '47.06, 0.73', 'postal_code'] = '37240'
-	df.loc[df['lat_lon'] == '49.13, 4.53', 'postal_code'] = '51600'
-	df.loc[df['lat_lon'] == '48.97, 4.46', 'postal_code'] = '51460'
-	df.loc[df['lat_lon'] == '48.97, 4.34', 'postal_code'] = '51000'
-	df.loc[df['lat_lon'] == '48.96, 4.31', 'postal_code'] = '51510'
-	df.loc[df['lat_lon'] == '49.09, 4.89', 'postal_code'] = '51800'
-	df.loc[df['lat_lon'] == '48.94, 4.88', 'postal_code'] = '51330'
-	df.loc[df['lat_lon'] == '48.78, 4.91', 'postal_code'] = '51250'
-	df.loc[df['lat_lon'] == '48.76, 4.84', 'postal_code'] = '51340'
-	df.loc[df['lat_lon'] == '48.90, 4.00', 'postal_code'] = '51130'
-	df.loc[df['lat_lon'] == '49.17, 4.22', 'postal_code'] = '51360'
-	df.loc[df['lat_lon'] == '49.13, 4.36', 'postal_code'] = '51400'
-	df.loc[df['lat_lon'] == '49.14, 4.16', 'postal_code'] = '51380'
-	df.loc[df['lat_lon'] == '49.22, 4.05', 'postal_code'] = '51350'
-	df.loc[df['lat_lon'] == '43.90, 2.27', 'postal_code'] = '81430'
-	df.loc[df['lat_lon'] == '43.89, 2.42', 'postal_code'] = '81430'
-	df.loc[df['lat_lon'] == '43.89, 1.97', 'postal_code'] = '81150'
-	df.loc[df['lat_lon'] == '43.80, 2.36', 'postal_code'] = '81120'
-	df.loc[df['lat_lon'] == '43.51, 2.35', 'postal_code'] = '81200'
-	df.loc[df['lat_lon'] == '50.79, 4.30', 'postal_code'] = '' # Belgium
-	df.loc[df['lat_lon'] == '49.43, 2.70', 'postal_code'] = '60190'
-	df.loc[df['lat_lon'] == '49.48, 0.13', 'postal_code'] = '76600'
-	df.loc[df['lat_lon'] == '49.49, 0.17', 'postal_code'] = '76600'
-	df.loc[df['lat_lon'] == '49.52, 0.11', 'postal_code'] = '76620'
-	df.loc[df['lat_lon'] == '49.64, 0.15', 'postal_code'] = '76280'
-	df.loc[df['lat_lon'] == '49.50, 0.17', 'postal_code'] = '76600'
-	df.loc[df['lat_lon'] == '49.51, 0.16', 'postal_code'] = '76610'
-	df.loc[df['lat_lon'] == '49.51, 0.09', 'postal_code'] = '76620'
-	df.loc[df['lat_lon'] == '49.51, 0.11', 'postal_code'] = '76620'
-	df.loc[df['lat_lon'] == '49.50, 0.10', 'postal_code'] = '76600'
-	df.loc[df['lat_lon'] == '49.50, 0.11', 'postal_code'] = '76600'
-	df.loc[df['lat_lon'] == '47.70, 2.94', 'postal_code'] = '89220'
-	df.loc[df['lat_lon'] == '47.70, 2.95', 'postal_code'] = '89220'
-	df.loc[df['lat_lon'] == '48.18, 1.63', 'postal_code'] = '28150'
-	df.loc[df['lat_lon'] == '43.36, -1.72', 'postal_code'] = '64122'
-	df.loc[df['lat_lon'] == '45.67, 5.49', 'postal_code'] = '38510'
-	df.loc[df['lat_lon'] == '46.71, 4.39', 'postal_code'] = '71450'
-
-	df.loc[df['lat_lon'] == '41.93, 8.75', 'postal_code'] = '20090'
+# Manual postal code overrides keyed by the rounded GPS coordinates `lat_lon` (see `map_coordinates_to_postal_code()`)
+# An empty `postal_code` means the location is out of scope (wrong coordinates, outside of France, ...)
+def load_postal_code_overrides(path='data/postal_code_overrides.csv'):
+	overrides = pd.read_csv(path, sep=';', dtype=str, keep_default_na=False)
+	# The last entry wins if the same location is listed more than once
+	overrides = overrides.drop_duplicates(subset='lat_lon', keep='last')
+	return overrides.set_index('lat_lon')['postal_code']
+
+@profiled()
+def postal_code_manual_fixes(df, report_path='data/postal_code_overrides_report.csv'):
+	# Fill in the missing postal codes manually based GPS coordinates `coordonneesXY`, in one pass over the dataset
+	overrides = load_postal_code_overrides()
+	fixed_codes = df['lat_lon'].map(overrides)
+	mask_fixed = fixed_codes.notnull()
+	# The rows where the GPS based fill already found the same postal code
+	mask_unchanged = mask_fixed & (df['postal_code'] == fixed_codes)
+	df.loc[mask_fixed, 'postal_code'] = fixed_codes[mask_fixed]
+
+	# Number of rows updated by each override, the overrides with 0 hits (or only `unchanged` ones) can be removed from the file
+	report = overrides.to_frame()
+	report['rows'] = df.loc[mask_fixed, 'lat_lon'].value_counts().reindex(report.index, fill_value=0)
+	report['unchanged'] = df.loc[mask_unchanged, 'lat_lon'].value_counts().reindex(report.index, fill_value=0)
+	if report_path:
+		report.to_csv(report_path, sep=';')
+	print(f'Manual fixes: `{mask_fixed.sum()}` rows updated by `{(report["rows"] > 0).sum()}` of `{len(report)}` overrides')
 
 	return df
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-# This will display the number of missing values in each column (missing in RED, no missing in GREEN)
-# @st.cache_data
-def display_missing_values(charging_points):
-	st.write(f"DEBUG: Missing values in :")
-	for column in charging_points.columns:	
-		missing_values = charging_points[column].isna().sum()
-		if missing_values > 0:
-			st.markdown(f"<font color='red'>**{column}: {missing_values}**</font>", unsafe_allow_html=True)
-		else:
-			st.markdown(f"<font color='green'>**{column}: {missing_values}**</font>", unsafe_allow_html=True)
-# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Reference (row by row) implementation of the postal code extraction, the first 5 digits window in the string
+# Kept to check the vectorized version against it (see `check_postal_code_extraction.py`)
+def find_postal_code(s):
+	for i in range(len(s)):
+		if s[i:i+5].isdigit() and len(s[i:i+5]) == 5:
+			return s[i:i+5]
+	return None
+
+# 5 digits not preceded nor followed by another digit, so SIRET, phone numbers and other longer digit runs are rejected
+POSTAL_CODE_PATTERN = re.compile(r'(?<![0-9])([0-9]{5})(?![0-9])')
 
 # This will extract the postal code from `adresse_station` and store it in `postal_code`, new column
+@profiled()
 def extract_postal_code_from_str(df):
-	def find_postal_code(s):
-		for i in range(len(s)):
-			if s[i:i+5].isdigit() and len(s[i:i+5]) == 5:
-				return s[i:i+5]
-		return None
-
-	df['postal_code'] = df['adresse_station'].apply(find_postal_code)
+	df['postal_code'] = df['adresse_station'].str.extract(POSTAL_CODE_PATTERN, expand=False)
 	return df
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -228,150 +99,445 @@ def select_columns(df, columns):
 	new_df = df[columns].copy()
 	return new_df
 
-def map_coordinates_to_postal_code(df):
-	# Converting the GPS coordinates to a specific format (e.g. from  `[-0.056488 , 48.723084]` to `48.723,-0.056`)
-	def process_coordinates(str):
-		coords = str.replace(' ', '').replace('[', '').replace(']', '')
-		coord_list = coords.split(',')
-		reverse_coords = reversed(coord_list)
-		formatted_list = [coord[:coord.index('.')+3] if '.' in coord else coord for coord in reverse_coords]
-		modified_coords = ', '.join(formatted_list)
-		return modified_coords
+# Parsing the GPS coordinates `coordonneesXY` (e.g. `[-0.056488 , 48.723084]`) into float `lon` and `lat` columns
+# and the `lat_lon` key truncated to 2 decimals (e.g. `48.72, -0.05`), used by the manual fixes.
+# Parsed and formatted once per distinct `coordonneesXY` value (a charging point is declared several times, and a station
+# has several points at the same location), then spread back to the rows by their codes
+@profiled()
+def parse_coordinates(df):
+	codes, uniques = pd.factorize(df['coordonneesXY'])
+	lon, lat = coordinates(pd.Series(uniques, dtype=object))
+	lat = lat.to_numpy()
+	lon = lon.to_numpy()
+
+	# Truncating (not rounding), the small epsilon absorbs the float error of `x * 100` (e.g. 48.72 * 100 = 4871.999...)
+	lat_trunc = np.trunc(lat * 100 + np.sign(lat) * 1e-6) / 100
+	lon_trunc = np.trunc(lon * 100 + np.sign(lon) * 1e-6) / 100
+	lat_lon = np.array([
+		f'{y:.2f}, {x:.2f}' if y == y and x == x else None for y, x in zip(lat_trunc.tolist(), lon_trunc.tolist())
+	] + [None], dtype=object)
+
+	# Code -1 (missing `coordonneesXY`) takes the last value: NaN / None
+	df['lon'] = np.append(lon, np.nan)[codes]
+	df['lat'] = np.append(lat, np.nan)[codes]
+	df['lat_lon'] = lat_lon[codes]
 
-	df['lat_lon'] = df['coordonneesXY'].apply(process_coordinates)
+	return df
 
-	# Mapping the GPS coordinates form `lat_lon` to `postal_code` values
-	coord_to_code = df[df['postal_code'].notnull()].set_index('lat_lon')['postal_code'].to_dict()
-	# Fill in the missing postal codes based on the GPS coordinates mapping
-	df.loc[df['postal_code'].isnull(), 'postal_code'] = df['lat_lon'].map(coord_to_code)
+# Nearest known location for each of the given points, for all the points at once: the known locations are put in
+# square cells of `max_distance` degrees (a grid like the one of the `lat_lon` fill), each point is paired with the
+# locations of the cells around it (merge on the cell keys), then the nearest pair of each point is kept.
+# Returns the index (in `known_lat`/`known_lon`) of the nearest location or -1 if there is none within `max_distance` (degrees).
+# Equal distances are resolved by the latitude order of the known locations (stable), as a scan of them would
+def nearest_known_location(lat, lon, known_lat, known_lon, max_distance):
+	rank = np.empty(len(known_lat), dtype=np.int64)
+	rank[np.argsort(known_lat, kind='stable')] = np.arange(len(known_lat))
+	known = pd.DataFrame({
+		'x': np.floor(known_lon / max_distance).astype(np.int64),
+		'y': np.floor(known_lat / max_distance).astype(np.int64),
+		'known': np.arange(len(known_lat)),
+	})
+
+	# Equirectangular approximation, good enough at this scale: the longitudes within `max_distance / cos(lat)`
+	# (the whole circle at most, near the poles), slightly widened so the float rounding never leaves a location out
+	cos_lat = np.cos(np.radians(lat))
+	with np.errstate(divide='ignore'):
+		half_width = np.minimum(max_distance / np.abs(cos_lat) * (1 + 1e-9), 360.0)
+	valid = np.isfinite(lat) & np.isfinite(lon)
+	lat_in, lon_in, half_width = np.where(valid, lat, 0), np.where(valid, lon, 0), np.where(valid, half_width, 0)
+	x0 = np.floor((lon_in - half_width) / max_distance).astype(np.int64)
+	x1 = np.floor((lon_in + half_width) / max_distance).astype(np.int64)
+	y0 = np.floor((lat_in - max_distance) / max_distance).astype(np.int64)
+	y1 = np.floor((lat_in + max_distance) / max_distance).astype(np.int64)
+
+	# One row per point and cell around it
+	width = x1 - x0 + 1
+	cells = np.where(valid, width * (y1 - y0 + 1), 0)
+	point = np.repeat(np.arange(len(lat)), cells)
+	offset = np.arange(cells.sum()) - np.repeat(np.cumsum(cells) - cells, cells)
+	pairs = pd.DataFrame({'x': x0[point] + offset % width[point], 'y': y0[point] + offset // width[point], 'point': point})
+	pairs = pairs.merge(known, on=['x', 'y'])
+	point = pairs['point'].to_numpy()
+	candidate = pairs['known'].to_numpy()
+
+	d_lat = known_lat[candidate] - lat[point]
+	d_lon = (known_lon[candidate] - lon[point]) * cos_lat[point]
+	distance = d_lat ** 2 + d_lon ** 2
+	within = (known_lat[candidate] >= lat[point] - max_distance) & (known_lat[candidate] <= lat[point] + max_distance) & (distance <= max_distance ** 2)
+	point, candidate, distance = point[within], candidate[within], distance[within]
+
+	# The nearest location of each point, the first one in the latitude order for equal distances
+	order = np.lexsort((rank[candidate], distance, point))
+	first = order[np.r_[True, point[order][1:] != point[order][:-1]]] if len(order) else order
+	nearest = np.full(len(lat), -1, dtype=np.int64)
+	nearest[point[first]] = candidate[first]
+	return nearest
+
+# Filling in the missing postal codes based on the GPS coordinates of the rows which have one:
+# 1. Grid keyed on `lat_lon` (about 1km cells), using the most frequent postal code of the cell
+# 2. Nearest known location (within `max_distance` degrees, about 2km) for the rows still missing
+# `reference` (columns `lat_lon`, `lat`, `lon`, `postal_code`) adds known locations which are not in `df`,
+# e.g. the rows processed by the previous runs in the incremental mode
+@profiled()
+def map_coordinates_to_postal_code(df, max_distance=0.02, reference=None):
+	# Already parsed by `normalise_rows()`
+	if 'lat_lon' not in df.columns:
+		df = parse_coordinates(df)
+
+	mask_known = df['postal_code'].notnull() & df['lat_lon'].notnull()
+	known = df.loc[mask_known, ['lat_lon', 'lat', 'lon', 'postal_code']]
+	if reference is not None:
+		known = pd.concat([reference[['lat_lon', 'lat', 'lon', 'postal_code']], known], ignore_index=True)
+
+	# Most frequent postal code for each `lat_lon` cell
+	cell_counts = known.groupby(['lat_lon', 'postal_code']).size().reset_index(name='count')
+	cell_counts = cell_counts.sort_values('count', kind='stable').drop_duplicates(subset='lat_lon', keep='last')
+	cell_to_code = cell_counts.set_index('lat_lon')['postal_code']
+
+	mask_missing = df['postal_code'].isnull()
+	df.loc[mask_missing, 'postal_code'] = df.loc[mask_missing, 'lat_lon'].map(cell_to_code)
+
+	# Nearest neighbour for the rows whose cell has no known postal code
+	mask_missing = df['postal_code'].isnull() & df['lat'].notnull() & df['lon'].notnull()
+	if mask_missing.any() and len(known) > 0:
+		# Sorted first so the location kept and the ties do not depend on the order of the rows (see the incremental mode)
+		known = known.sort_values(['lat', 'lon', 'postal_code'], kind='stable').drop_duplicates(subset=['lat', 'lon'])
+		nearest = nearest_known_location(
+			df.loc[mask_missing, 'lat'].to_numpy(), df.loc[mask_missing, 'lon'].to_numpy(),
+			known['lat'].to_numpy(), known['lon'].to_numpy(), max_distance,
+		)
+		codes = np.where(nearest >= 0, known['postal_code'].to_numpy()[nearest], None)
+		df.loc[mask_missing, 'postal_code'] = codes
 
 	return df
 
-def process_missing_postal_codes(df_epoints):
-	df_epoints = select_columns(df_epoints, ['adresse_station', 'coordonneesXY', 'consolidated_code_postal', 'created_at'])
+# DEDUPLICATION KEYS
+# The consolidated file declares the same charging point several times, and a station has several points.
+# `point_key` / `station_key`: 64 bits hash of the identifier (`id_pdc_itinerance` / `id_station_itinerance`, trimmed,
+# upper case) and of the coordinates rounded to `KEY_DECIMALS` decimals (about 1m), for all the rows at once.
+# The rows without identifier are told apart by their coordinates only.
+KEY_DECIMALS = 5
+KEY_COLUMNS = {'point_key': 'id_pdc_itinerance', 'station_key': 'id_station_itinerance'}
+
+@profiled()
+def hash_keys(df):
+	lat = df['lat'].round(KEY_DECIMALS)
+	lon = df['lon'].round(KEY_DECIMALS)
+	for key, id_column in KEY_COLUMNS.items():
+		ids = df[id_column].fillna('').astype(str).str.strip().str.upper()
+		df[key] = pd.util.hash_pandas_object(pd.DataFrame({'id': ids, 'lat': lat, 'lon': lon}), index=False).to_numpy()
+	return df
 
+# The stages where each row only depends on itself: they can run on partitions of the dataset (see `map_partitions()`)
+def normalise_rows(df_epoints):
 	df_epoints = extract_postal_code_from_str(df_epoints) # Extract postal code from `adresse_station` string and store it in `postal_code`, new column
 	df_epoints['postal_code'] = df_epoints['postal_code'].fillna(df_epoints['consolidated_code_postal']) # Copy the code from 'consolidated_code_postal' to 'postal_code' if it's not null
+	df_epoints = parse_coordinates(df_epoints)
+	df_epoints = hash_keys(df_epoints)
+	return df_epoints
 
+# Running `func` on `workers` partitions of `df` (contiguous rows) in as many processes, the results are concatenated
+# back in the same order so the output is the same as `func(df)`. Small datasets are not worth the transfer cost.
+MIN_PARTITION_ROWS = 50000
+
+@profiled()
+def map_partitions(df, func, workers=1):
+	workers = min(workers, len(df) // MIN_PARTITION_ROWS)
+	if workers <= 1:
+		return func(df)
+	bounds = np.linspace(0, len(df), workers + 1).astype(int)
+	partitions = [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		return pd.concat(executor.map(func, partitions))
+
+# The row by row stages, on `workers` processes: the postal code found in the row itself, the coordinates and the keys
+@profiled()
+def normalise_epoints(df_epoints, workers=1):
+	df_epoints = select_columns(df_epoints, ['adresse_station', 'coordonneesXY', 'consolidated_code_postal', 'created_at', 'id_pdc_itinerance', 'id_station_itinerance'])
+	return map_partitions(df_epoints, normalise_rows, workers)
+
+# The stages which need the other rows, once the partitions are merged: the GPS based fill of the rows without postal code
+# (`reference` adds known locations which are not in `df_epoints`) and the manual fixes
+@profiled()
+def resolve_postal_codes(df_epoints, reference=None, report_path='data/postal_code_overrides_report.csv'):
 	# This will fill in the postal code based on similar GPS coordinates in new `lat_lon` column
-	df_epoints = map_coordinates_to_postal_code(df_epoints)
+	df_epoints = map_coordinates_to_postal_code(df_epoints, reference=reference)
 
 	# Some manual fixes (around 600 rows with 150 unique locations) for the remaining missing postal codes
-	df_epoints = postal_code_manual_fixes(df_epoints)
+	df_epoints = postal_code_manual_fixes(df_epoints, report_path=report_path)
 
-	# This will convert the postal codes to string and set/keep the missing values to None
-	df_epoints['postal_code'] = df_epoints['postal_code'].where(df_epoints['postal_code'].isnull(), df_epoints['postal_code'].astype(str))
+	# This will convert the postal codes to a categorical of strings and keep the missing values (see `dimensions.py`)
+	df_epoints['postal_code'] = postal_codes(df_epoints['postal_code'])
 
 	return df_epoints
+
+@profiled()
+def process_missing_postal_codes(df_epoints, reference=None, report_path='data/postal_code_overrides_report.csv', workers=1):
+	df_epoints = normalise_epoints(df_epoints, workers)
+	# The postal code found in the row itself, before the GPS based fill (kept in the state of the incremental mode)
+	df_epoints['postal_direct'] = postal_codes(df_epoints['postal_code'])
+	return resolve_postal_codes(df_epoints, reference=reference, report_path=report_path)
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+@profiled()
 def adding_department(df):
-	df['dept_code'] = df['postal_code'].str[:2]
-	# Fix the postal codes for Corsica (20) to 2A and 2B
-	df_corse = pd.read_csv('data/code-postal-corse.csv', sep=';', dtype=str)
-	# st.write(df_corse)
-	# Replace `20` with `2A` and `2B` for Corsica in `department` column. Using mapping from `code-postal-corse.csv`
-	df['dept_code'] = df['dept_code'].replace('20', np.nan)
-	code_to_dep = df_corse.set_index('Code_postal')['CODE_DEPT'].to_dict()
-	df['dept_code'] = df['dept_code'].fillna(df['postal_code'].map(code_to_dep))
+	# The department of each distinct postal code, from the prebuilt postal code index (2A and 2B for Corsica,
+	# see `dept_index.py`)
+	df['dept_code'] = postal_dept_codes(df['postal_code'])
 
 	# This will drop the rows with empty `department` values as well as all that is not in the range of 1-95 + 2A + 2B
-	mask_empty = df['dept_code'] == ''
-	mask_not_in_range = ~df['dept_code'].isin([str(i).zfill(2) for i in range(0, 96)] + ['2A', '2B'])
-	df = df[~(mask_empty | mask_not_in_range)].copy()
-
-	# Load the `fr-ref-geo.csv` file to map the department codes to department names
-	df_fr_dep = pd.read_csv('data/fr-ref-geo.csv', sep=';', dtype=str)
-	# st.write(df_fr_dep)
-	dep_to_name = df_fr_dep.set_index('DEP_CODE')['DEP_NOM'].to_dict()
-	df['dept_name'] = df['dept_code'].map(dep_to_name)
-
-	# Extract the year from the `created_at` into `year` column and keep only the `dept_code`, `dept_name` and `year` columns in the DataFrame
-	df['year'] = df['created_at'].str.slice(0, 4)
-	df = df[['dept_code', 'dept_name', 'year']]
+	# (missing in the categorical `dept_code`, see `dimensions.py`)
+	df = df[df['dept_code'].notnull()].copy()
+
+	# Mapping the department codes to department names (`fr-ref-geo.csv`, kept in the index)
+	df['dept_name'] = dept_names(df['dept_code'], dept_names_map())
+
+	# Extract the year (small integer) from the `created_at` into `year` column and keep only the `dept_code`, `dept_name` and `year` columns in the DataFrame
+	df['year'] = years(df['created_at'])
+	df = df[['dept_code', 'dept_name', 'year'] + list(KEY_COLUMNS)]
 	return df
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-def transform_data(df):
-	df['epoints'] = 1
-	pivot_df = pd.pivot_table(df, index=['dept_code', 'dept_name'], columns='year', values='epoints', aggfunc='sum', fill_value=0)
-	# pivot_df = pd.pivot_table(df, index=['dept_code', 'dept_name'], columns='year', aggfunc='sum', fill_value=0)
-	# pivot_df.reset_index(inplace=True)
-	# pivot_df.columns = ['_'.join(str(col)).strip('_') for col in pivot_df.columns.values]
-	# pivot_df.columns = ['dept_code', 'dept_name', '2021', '2022', '2023', '2024']
-	# pivot_df['total'] = pivot_df.iloc[:, 2:].sum(axis=1)
-	pivot_df['total'] = pivot_df[['2021', '2022', '2023', '2024', '2025']].sum(axis=1)
+# What a charging point is for the pivot table:
+# - `rows`: every row of `charging_points.csv`
+# - `points`: the distinct points (`point_key`), `stations`: the distinct stations (`station_key`)
+COUNT_MODES = ['rows', 'points', 'stations']
+COUNT_KEYS = {'points': 'point_key', 'stations': 'station_key'}
+
+# One row per key, in the department and the year of its first declaration (hash based). The row kept is the one with
+# the smallest (year, department) rank, one integer per row (the missing years and departments last), so the department
+# does not depend on the order of the rows (see the incremental mode) and no sort of the rows is needed
+@profiled()
+def distinct_rows(df, key):
+	year = df['year'].to_numpy(dtype=float, na_value=np.nan)
+	dept = df['dept_code'].astype(DEPT_DTYPE).cat.codes.to_numpy().astype(np.int64)
+	n_depts = len(DEPT_CODES) + 1
+	year_rank = np.where(np.isnan(year), np.nanmax(year, initial=0) + 1, year).astype(np.int64)
+	rank = year_rank * n_depts + np.where(dept >= 0, dept, n_depts - 1)
+
+	first = pd.Series(rank).groupby(df[key].to_numpy(), sort=False).idxmin().to_numpy()
+	rows = df.iloc[first][['dept_code', 'dept_name', 'year']]
+	return rows.set_axis(pd.Index(df[key].to_numpy()[first], name=key))
+
+# Number of charging points per department and year, the years are the ones found in `created_at` (see `dimensions.py`)
+@profiled()
+def transform_data(df, count='rows'):
+	if count != 'rows':
+		df = distinct_rows(df, COUNT_KEYS[count])
+	pivot_df = pivot_dept_year(df)
 	return pivot_df
-# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+@profiled()
+def save_pivot(pivot_df):
+	pivot_df.to_csv('data/epoints_pivot.csv')
 
-def main():
-	# epoints, geo_ref = load_dataset()
-	epoints = load_dataset()
+	# Saving the cumulative sum of the pivot table as well
+	pivot_df_cumsum = cumsum_pivot(pivot_df)
+	pivot_df_cumsum.to_csv('data/epoints_pivot_cumsum.csv')
 
-	## PREPROCESSING DATASET ##
+	print('The final datasets have been saved to `data/epoints_pivot.csv` and `data/epoints_pivot_cumsum.csv`')
 
-	# DEBUG #
-	# missing_values = epoints[epoints['consolidated_code_postal'].isnull()]
-	# st.write(f'Initislly missing values in `consolidated_code_postal` column: `{missing_values.shape[0]}` in dataset `epoints`')
-	# # # # #
+	# The dashboard metrics need the vehicles dataset as well (see `metrics_cube.py`)
+	update_metrics_cube()
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-	df_epoints = process_missing_postal_codes(epoints)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# INCREMENTAL MODE
+# The state file keeps one row per processed charging point: the hash of its input columns, its coordinates,
+# the postal code found in the row itself `postal_direct` (address or `consolidated_code_postal`, used as reference
+# for the GPS fill), the resolved `postal_code`, its `point_key` / `station_key`, `year`, `dept_code` and `dept_name`
+# (NaN `dept_code` for the rows dropped by `adding_department()`).
+# A run then only processes the rows whose hash is not in the state, and the rows which disappeared from
+# `charging_points.csv` are subtracted from the pivot. A modified row is one removed and one added row.
+# The postal code of the rows without `postal_direct` (GPS fill, or not found) depends on the other rows: these rows
+# are resolved again on every run, against all the current rows, so the output is the same as a full run.
+# The distinct points / stations cannot be subtracted that way, their pivot is counted again from the state.
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-	df_epoints = adding_department(df_epoints)
-	# st.write(f'Preprocessed dataset `df_epoints`, rows count: `{df_epoints.shape[0]}`')
-	# st.write(df_epoints)
+STATE_PATH = 'data/epoints_state.parquet'
+STATE_COLUMNS = ['row_hash', 'lat_lon', 'lat', 'lon', 'postal_direct', 'postal_code'] + list(KEY_COLUMNS) + ['year', 'dept_code', 'dept_name']
+HASH_COLUMNS = ['adresse_station', 'coordonneesXY', 'consolidated_code_postal', 'created_at', 'id_pdc_itinerance', 'id_station_itinerance']
+
+@profiled()
+def hash_rows(df):
+	return pd.util.hash_pandas_object(df[HASH_COLUMNS].astype(str), index=False)
+
+# One state row per row of `df` (see `process_missing_postal_codes()`), with its department from `df_dept`
+# (see `adding_department()`, none for the rows it dropped). The index is kept along the way
+def state_rows(df, df_dept, row_hash):
+	df = df.assign(row_hash=row_hash, year=years(df['created_at']))
+	return df.join(df_dept[['dept_code', 'dept_name']])[STATE_COLUMNS]
+
+# Processing the given rows up to the department, keeping one state row per input row
+@profiled()
+def process_rows(epoints, row_hash, report_path='data/postal_code_overrides_report.csv', workers=1):
+	df = process_missing_postal_codes(epoints, report_path=report_path, workers=workers)
+	df_dept = adding_department(df.copy())
+	return state_rows(df, df_dept, row_hash), df_dept
+
+# The rows with the postal codes found in the rows themselves (`postal_direct`), resolved against the `reference`
+# locations, with their department
+@profiled()
+def resolve_state_rows(pending, reference):
+	pending = pending.assign(postal_code=pending['postal_direct'].astype(object))
+	resolved = resolve_postal_codes(pending[['lat_lon', 'lat', 'lon', 'postal_code']].copy(), reference=reference, report_path=None)
+	pending['postal_code'] = resolved['postal_code']
+	pending['dept_code'] = postal_dept_codes(pending['postal_code'])
+	pending['dept_name'] = dept_names(pending['dept_code'], dept_names_map())
+	return pending[STATE_COLUMNS]
+
+@profiled()
+def load_state():
+	return pd.read_parquet(STATE_PATH)
+
+# The count mode of the pivot table saved with the state (see `COUNT_MODES`)
+def load_state_count():
+	if not os.path.exists(STATE_PATH + '.json'):
+		return 'rows'
+	with open(STATE_PATH + '.json') as f:
+		return json.load(f)['count']
+
+@profiled()
+def save_state(state, count='rows'):
+	state.reset_index(drop=True).to_parquet(STATE_PATH + '.tmp', index=False)
+	os.replace(STATE_PATH + '.tmp', STATE_PATH)
+	with open(STATE_PATH + '.json', 'w') as f:
+		json.dump({'count': count}, f)
+
+@profiled()
+def run_full(epoints, workers=1, count='rows'):
+	row_hash = hash_rows(epoints)
+	state, df_epoints = process_rows(epoints, row_hash, workers=workers)
+
+	pivot_df = transform_data(df_epoints, count)
+	save_pivot(pivot_df)
+	save_state(state, count)
+	save_station_bins(build_station_bins(state))
+	return pivot_df, state
+
+# The rows of the frames one after the other (the empty frames are left out, they would change the types of the columns)
+def concat_rows(frames):
+	frames = [frame for frame in frames if len(frame) > 0] or frames[:1]
+	return pd.concat(frames, ignore_index=True)
+
+# Rows of `df` to take so that each hash appears `counts[hash]` times
+def take_rows_per_hash(df, counts):
+	counts = counts[counts > 0]
+	rows = df[df['row_hash'].isin(counts.index)]
+	rank = rows.groupby('row_hash').cumcount()
+	return rows[rank < rows['row_hash'].map(counts)]
+
+@profiled()
+def run_incremental(epoints, workers=1, count='rows'):
+	state = load_state()
+	row_hash = hash_rows(epoints)
+
+	# Multiset difference between the current rows and the already processed ones
+	new_counts = row_hash.value_counts()
+	old_counts = state['row_hash'].value_counts()
+	diff = new_counts.sub(old_counts, fill_value=0).astype(int)
+
+	removed = take_rows_per_hash(state, -diff)
+	added_rows = take_rows_per_hash(epoints.assign(row_hash=row_hash), diff)
+	print(f'Incremental run: `{len(added_rows)}` new rows, `{len(removed)}` removed rows, `{len(epoints) - len(added_rows)}` unchanged rows')
+
+	state = state.drop(index=removed.index)
+	added = normalise_epoints(added_rows[HASH_COLUMNS], workers)
+	added['postal_direct'] = postal_codes(added['postal_code'])
+	added['row_hash'] = added_rows['row_hash']
+	added['year'] = years(added['created_at'])
+
+	# The GPS fill of the new rows and of the already processed rows without `postal_direct` is done again, against
+	# the locations of all the current rows with `postal_direct` (the same known locations as a full run)
+	is_direct = state['postal_direct'].notnull()
+	previous = state[~is_direct]
+	unchanged = state[is_direct]
+	reference = unchanged.loc[unchanged['lat_lon'].notnull(), ['lat_lon', 'lat', 'lon', 'postal_direct']]
+	reference = reference.rename(columns={'postal_direct': 'postal_code'}).astype({'postal_code': object})
+	columns = {'postal_direct': object, 'postal_code': object}
+	pending = concat_rows([previous.drop(columns=['dept_code', 'dept_name']).astype(columns), added[STATE_COLUMNS[:-2]].astype(columns)])
+	resolved = resolve_state_rows(pending, reference)
+	state = concat_rows([unchanged.astype(columns), resolved.astype(columns)])
+	state['postal_direct'] = postal_codes(state['postal_direct'].astype(object))
+	state['postal_code'] = postal_codes(state['postal_code'].astype(object))
+
+	if count == 'rows' and load_state_count() == 'rows':
+		# The rows resolved again are counted as removed (previous resolution) and added (current one)
+		pivot_df = pd.read_csv('data/epoints_pivot.csv', dtype={'dept_code': str, 'dept_name': str}, index_col=['dept_code', 'dept_name'])
+		pivot_df = apply_pivot_delta(pivot_df, resolved, concat_rows([removed, previous]))
+	else:
+		pivot_df = transform_data(state.dropna(subset=['dept_code']), count)
+	save_pivot(pivot_df)
+	save_state(state, count)
+	save_station_bins(build_station_bins(state))
+	return pivot_df, state
+
+# Number of points per department and year, with the same string keys as the pivot table read from its CSV file
+def count_points(state):
+	counts = state.dropna(subset=['dept_code']).groupby(['dept_code', 'dept_name', 'year'], observed=True).size()
+	return counts.rename(index=str)
+
+# Adding the points of `added` to the pivot table and subtracting the points of `removed`
+@profiled()
+def apply_pivot_delta(pivot_df, added, removed):
+	delta = count_points(added).sub(count_points(removed), fill_value=0)
+
+	counts = pivot_df.drop(columns='total')
+	counts.columns.name = 'year'
+	if len(delta) > 0:
+		counts = counts.add(delta.unstack('year', fill_value=0), fill_value=0).fillna(0).astype(int)
+		counts = counts.sort_index().sort_index(axis=1)
+	# Departments without any point left
+	counts = counts[counts.sum(axis=1) > 0]
+	return add_total(fill_years(counts))
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-	pivot_df = transform_data(df_epoints)
+def parse_args():
+	parser = argparse.ArgumentParser(description='Preprocessing of the charging points dataset `data/charging_points.csv`')
+	parser.add_argument('--incremental', action='store_true', help='Only process the rows added or changed since the last run')
+	parser.add_argument('--full', action='store_true', help='Rebuild everything from scratch (default)')
+	parser.add_argument('--workers', type=int, default=1, help='Number of processes for the row by row cleaning stages (0: one per CPU core)')
+	parser.add_argument('--count', choices=COUNT_MODES, default='rows', help='Count every row (default), the distinct points or the distinct stations')
+	add_profile_argument(parser)
+	return parser.parse_args()
 
-	pivot_df.to_csv('data/epoints_pivot.csv')
 
-	# Saving the cumulative sum of the pivot table as well
-	pivot_df_cumsum = pivot_df.loc[:, '2021':'2025'].cumsum(axis=1)
-	pivot_df_cumsum.to_csv('data/epoints_pivot_cumsum.csv')
+def run_pipeline(args):
+	# epoints, geo_ref = load_dataset()
+	epoints = load_dataset()
+	workers = args.workers or os.cpu_count()
 
-	print('The final datasets have been saved to `data/epoints_pivot.csv` and `data/epoints_pivot_cumsum.csv`')
+	## PREPROCESSING DATASET ##
 
-	# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-	# TO RUN THE FOLLOWING CODE THE STREAMLIT APP NEEDS TO BE LAUNCHED FIRST
-	# # DEBUG # #
-	# st.write(f'Pivot table `pivot_df`, rows count: `{pivot_df.shape[0]}`')
-	# st.write(pivot_df)
-	# st.write(f'Pivot table saved to `data/epoints_pivot.csv`')
-
-	# st.write(f'Pivot table `pivot_df_cumsum`, rows count: `{pivot_df_cumsum.shape[0]}`')
-	# st.write(pivot_df_cumsum)
-	# st.write(f'Pivot table saved to `data/epoints_pivot_cumsum.csv`')
-
-	# st.write(f'Original Dataframe `epoints`, rows count: `{epoints.shape[0]}`')
-	# st.write(epoints.shape)
-	# st.write(epoints)
-
-	# st.write(f'Filtered dataframe `df_epoints`, rows count (with '' empty string): `{filtered_df.shape[0]}`: ')
-	# if filtered_df.shape[0] > 0:
-	# 	st.write(filtered_df)
-
-	# filtered_df_unique = filtered_df.drop_duplicates(subset='postal_code')
-	# st.write(f'Filtered dataframe unique postal codes starting with `20`: `{filtered_df_unique.shape[0]}`')
-	# if filtered_df_unique.shape[0] > 0:
-	# 	st.write(filtered_df_unique)
-
-	# missing_values = df_epoints[df_epoints['postal_code'].isnull()]
-	# missing_values = df_epoints[df_epoints['department'].isnull()]
-	# st.write(f'Missing values in `department` column: `{missing_values.shape[0]}`, in dataframe `df_epoints`')
-	# if missing_values.shape[0] > 0:
-	# 	st.write(missing_values.shape)
-	# 	st.write(missing_values)
-	
-	# missing_values_unique_coords = missing_values.drop_duplicates(subset='coordonneesXY')
-	# missing_values_unique_coords = missing_values.drop_duplicates(subset='lat_lon')
-	# if missing_values_unique_coords.shape[0] > 0:
-	# 	st.write(f'Missing values with unique GPS coordinates (shape): `{missing_values_unique_coords.shape[0]}`')
-		# st.write(missing_values_unique_coords)
-	# # # # # # #
-
-	## GROUPING DATASET BY DEPATRMENT ##
+	# Falling back to a full rebuild when there is no previous run to start from (or a state of an older layout)
+	if args.incremental and not args.full and os.path.exists(STATE_PATH) and os.path.exists('data/epoints_pivot.csv') \
+			and set(STATE_COLUMNS) <= set(pq.read_schema(STATE_PATH).names):
+		pivot_df, state = run_incremental(epoints, workers, args.count)
+	else:
+		pivot_df, state = run_full(epoints, workers, args.count)
+
+	# Data quality of the source file, the rows dropped by the department filter are counted from the resolved postal codes
+	report = epoints_report(epoints, state)
+	save_report(report)
+
+	# DEBUG # Only shown when the script is launched with `streamlit run epoints_preprocess.py`
+	debug_panel({
+		'epoints': epoints,
+		'pivot_df': pivot_df,
+		'rows without department': state[state['dept_code'].isnull()],
+		'data quality': report_table(report),
+	})
+
+def main():
+	args = parse_args()
+	# The page is only set up when launched with `streamlit run epoints_preprocess.py` (debug panel),
+	# a batch run (`python epoints_preprocess.py`) does not import Streamlit at all
+	if in_streamlit():
+		import streamlit as st
+		st.set_page_config(page_title="Data Clean", layout="wide")
+	if args.profile:
+		enable(args.profile)
+	run_profiled(lambda: run_pipeline(args), 'epoints_preprocess')
 
 
 if __name__ == '__main__':
@@ -1,54 +1,200 @@
 # !!!!!!!!!!!!!!!!! CAREFUL !!!!!!!!!!!!!!!!!
 # This script is used to get the location data of the given latitude and longitude using Google Maps API.
-# The function get_location_data takes a dataframe as input and returns 
+# The function get_location_data takes a dataframe as input and returns
 # a new dataframe with the columns latitude, longitude, and location_data.
-# IT IS A PAID API 
+# IT IS A PAID API
 # !!!!!!!!!!!!!!!!! CAREFUL !!!!!!!!!!!!!!!!!
+#
+# Every answer (but the misses of `StaticFileGeocoder`) is stored as soon as it is received in an on-disk SQLite cache (`data/geocode_cache.sqlite`),
+# keyed by the rounded coordinates, so a crash loses nothing and a re-run only calls the API for new coordinates.
+# The geocoder is pluggable: `GoogleGeocoder` (its `base_url` can point to a local stand-in server)
+# or `StaticFileGeocoder` (answers from a JSON file, no network at all).
+#
+# Usage:
+#	python extract_geocode.py                                   # Google Maps API, key from `data/.env`
+#	python extract_geocode.py --base-url http://localhost:8000  # local stand-in server
+#	python extract_geocode.py --static-file data/geocode.json   # static file
 
 
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 import pandas as pd
-import os
 from dotenv import load_dotenv
 from tqdm import tqdm
 
 
-def get_location_data(df):
-	def get_data_from_api(lat, lon):
-		if (lat, lon) in location_cache:
-			return location_cache[(lat, lon)]
-		response = requests.get(f'https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lon}&key={API_KEY}')
+GOOGLE_GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+# Number of decimals kept in the cache key (6 decimals is about 10cm)
+COORDS_PRECISION = 6
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Persistent cache of the geocoding answers. `data` is the JSON of the first result, NULL if the API found nothing
+class GeocodeCache:
+	def __init__(self, path='data/geocode_cache.sqlite', precision=COORDS_PRECISION):
+		self.precision = precision
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		self.connection.execute('CREATE TABLE IF NOT EXISTS geocode (lat REAL, lon REAL, data TEXT, PRIMARY KEY (lat, lon))')
+		self.connection.commit()
+
+	def key(self, lat, lon):
+		return round(float(lat), self.precision), round(float(lon), self.precision)
+
+	# `misses=False` leaves out the coordinates for which nothing was found
+	def cached_keys(self, misses=True):
+		query = 'SELECT lat, lon FROM geocode' + ('' if misses else ' WHERE data IS NOT NULL')
+		with self.lock:
+			return set(self.connection.execute(query).fetchall())
+
+	# Written and committed one by one, so every paid answer survives a crash
+	def set(self, lat, lon, data):
+		with self.lock:
+			self.connection.execute('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)', (*self.key(lat, lon), None if data is None else json.dumps(data)))
+			self.connection.commit()
+
+	def to_dataframe(self):
+		with self.lock:
+			df = pd.read_sql_query('SELECT lat, lon, data FROM geocode WHERE data IS NOT NULL', self.connection)
+		df['location_data'] = df['data'].map(json.loads)
+		return df.drop(columns='data')
+
+	def close(self):
+		self.connection.close()
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Allows at most `rate` calls per second, shared between the threads
+class RateLimiter:
+	def __init__(self, rate):
+		self.interval = 1.0 / rate if rate else 0
+		self.lock = threading.Lock()
+		self.next_call = 0.0
+
+	def wait(self):
+		with self.lock:
+			now = time.monotonic()
+			delay = self.next_call - now
+			self.next_call = max(now, self.next_call) + self.interval
+		if delay > 0:
+			time.sleep(delay)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# The geocoders are callables `(lat, lon) -> first result (dict) or None` and raise if the answer must not be cached.
+# `cache_misses`: whether a `None` answer is cached as well (the coordinates are then never geocoded again)
+# `rate`: maximum number of calls per second (shared by the threads), `None` for no limit
+class GoogleGeocoder:
+	# A paid answer, even an empty one
+	cache_misses = True
+
+	def __init__(self, api_key, base_url=GOOGLE_GEOCODE_URL, timeout=10, rate=10):
+		self.api_key = api_key
+		self.base_url = base_url
+		self.timeout = timeout
+		self.rate = rate
+		# One HTTP session (connection pool) per thread, a session is not meant to be shared between threads
+		self.local = threading.local()
+
+	def session(self):
+		if not hasattr(self.local, 'session'):
+			self.local.session = requests.Session()
+		return self.local.session
+
+	def __call__(self, lat, lon):
+		response = self.session().get(self.base_url, params={'latlng': f'{lat},{lon}', 'key': self.api_key}, timeout=self.timeout)
+		response.raise_for_status()
 		data = response.json()
+		if data.get('status') == 'ZERO_RESULTS':
+			return None
 		if 'results' in data and len(data['results']) > 0:
-			location_cache[(lat, lon)] = data['results'][0]
 			return data['results'][0]
-		return None  # Handle cases where no results are found
-
-	location_cache = {}
-	new_location_data = []
-	unique_rows = df.drop_duplicates(subset=['consolidated_latitude', 'consolidated_longitude'])
-	for index, row in tqdm(unique_rows.iterrows(), total=unique_rows.shape[0]):
-		location_data_row = get_data_from_api(row['consolidated_latitude'], row['consolidated_longitude'])
-		if location_data_row:  # Only add data if API call succeeds
-			new_location_data.append({
-				'latitude': row['consolidated_latitude'],
-				'longitude': row['consolidated_longitude'],
-				'location_data': location_data_row
-			})
-
-	location_data = pd.DataFrame(new_location_data, columns=['latitude', 'longitude', 'location_data'])
-	return location_data
+		# Quota exceeded, denied request, ... (not cached, will be retried on the next run)
+		raise RuntimeError(f'Geocoding failed for ({lat}, {lon}): {data.get("status")} {data.get("error_message", "")}')
+
+# Answers from a JSON file `{"lat,lon": result, ...}`, used to run the script offline and in tests.
+# The coordinates missing from the file are not cached, and the ones cached as missing are asked again:
+# a new version of the file may have them
+class StaticFileGeocoder:
+	cache_misses = False
+	# Local lookups, not limited
+	rate = None
+
+	def __init__(self, path, precision=COORDS_PRECISION):
+		self.precision = precision
+		with open(path) as f:
+			raw = json.load(f)
+		self.results = {}
+		for key, value in raw.items():
+			lat, lon = key.split(',')
+			self.results[(round(float(lat), precision), round(float(lon), precision))] = value
+
+	def __call__(self, lat, lon):
+		return self.results.get((round(float(lat), self.precision), round(float(lon), self.precision)))
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def get_location_data(df, geocoder, cache, max_workers=8):
+	rate_limiter = RateLimiter(geocoder.rate) if geocoder.rate else None
+
+	def get_data_from_api(lat, lon):
+		if rate_limiter is not None:
+			rate_limiter.wait()
+		data = geocoder(lat, lon)
+		if data is not None or geocoder.cache_misses:
+			cache.set(lat, lon, data)
+		return data
+
+	# Only the coordinates which are not in the cache yet are sent to the geocoder
+	coords = df[['consolidated_latitude', 'consolidated_longitude']].dropna()
+	unique_keys = {cache.key(lat, lon) for lat, lon in coords.itertuples(index=False)}
+	missing_keys = sorted(unique_keys - cache.cached_keys(misses=geocoder.cache_misses))
+	print(f'Coordinates: `{len(unique_keys)}` unique, `{len(unique_keys) - len(missing_keys)}` cached, `{len(missing_keys)}` to geocode')
+
+	errors = 0
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		futures = [executor.submit(get_data_from_api, lat, lon) for lat, lon in missing_keys]
+		for future in tqdm(as_completed(futures), total=len(futures)):
+			try:
+				future.result()
+			except Exception as e:
+				errors += 1
+				print(e)
+	if errors > 0:
+		print(f'`{errors}` coordinates could not be geocoded, run the script again to retry them')
+
+	location_data = cache.to_dataframe()
+	location_data = location_data[[(lat, lon) in unique_keys for lat, lon in zip(location_data['lat'], location_data['lon'])]]
+	location_data = location_data.rename(columns={'lat': 'latitude', 'lon': 'longitude'})
+	return location_data[['latitude', 'longitude', 'location_data']].reset_index(drop=True)
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Reverse geocoding of the charging points coordinates')
+	parser.add_argument('--static-file', help='JSON file answering instead of the Google Maps API')
+	parser.add_argument('--base-url', default=GOOGLE_GEOCODE_URL, help='Geocoding endpoint (e.g. a local stand-in server)')
+	parser.add_argument('--cache', default='data/geocode_cache.sqlite', help='SQLite cache file')
+	parser.add_argument('--workers', type=int, default=8, help='Number of concurrent requests')
+	parser.add_argument('--rate', type=float, default=10, help='Maximum number of requests per second to the API (not used with `--static-file`)')
+	return parser.parse_args()
+
 
 if __name__ == "__main__":
-	load_dotenv('data/.env')
-	API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
+	args = parse_args()
+	if args.static_file:
+		geocoder = StaticFileGeocoder(args.static_file)
+	else:
+		load_dotenv('data/.env')
+		geocoder = GoogleGeocoder(os.getenv('GOOGLE_MAPS_API_KEY'), base_url=args.base_url, rate=args.rate)
+
 	df = pd.read_csv("data/charging_points.csv", low_memory=False)
 
-	# Check if location_data.csv already exists:
-	if os.path.exists("data/location_data.csv"):
-		print("Location data already exists.")
-		location_data = pd.read_csv("data/location_data.csv")
-	else:
-		# if not, get the location data and save it to a new file
-		location_data = get_location_data(df)
-		location_data.to_csv("data/location_data.csv", index=False)
+	cache = GeocodeCache(args.cache)
+	try:
+		location_data = get_location_data(df, geocoder, cache, max_workers=args.workers)
+	finally:
+		cache.close()
+	location_data.to_csv("data/location_data.csv", index=False)
@@ -0,0 +1,118 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Topology-preserving simplification of the departments boundaries (Polygon / MultiPolygon GeoJSON features).
+#
+# Simplifying each polygon on its own would move the border shared by two departments differently on each side
+# (gaps and overlaps on the map). Instead, as TopoJSON does:
+# 1. The coordinates are quantised (rounded to `precision` decimals), so the shared vertices are exactly equal
+# 2. The junctions are found: the vertices where the neighbours differ from one ring to another
+# 3. Each ring is cut at its junctions into arcs, each arc is simplified once (Douglas-Peucker, ends kept)
+#	and the same simplified arc is used by every ring sharing it
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import numpy as np
+
+
+def quantize_ring(ring, precision):
+	points = [(round(x, precision), round(y, precision)) for x, y in ring]
+	# Removing the consecutive duplicated points created by the rounding
+	points = [p for i, p in enumerate(points) if i == 0 or p != points[i - 1]]
+	if points[0] != points[-1]:
+		points.append(points[0])
+	return points
+
+# The polygons (lists of rings) of a geometry, to be modified in place
+def geometry_polygons(geometry):
+	if geometry['type'] == 'Polygon':
+		return [geometry['coordinates']]
+	if geometry['type'] == 'MultiPolygon':
+		return geometry['coordinates']
+	return []
+
+# Indexes of the points kept by the Douglas-Peucker algorithm (the first and the last point are always kept)
+def douglas_peucker(points, tolerance):
+	points = np.asarray(points, dtype=float)
+	keep = np.zeros(len(points), dtype=bool)
+	keep[0] = keep[-1] = True
+	stack = [(0, len(points) - 1)]
+	while stack:
+		start, end = stack.pop()
+		if end - start < 2:
+			continue
+		segment = points[end] - points[start]
+		vectors = points[start + 1:end] - points[start]
+		length = np.hypot(segment[0], segment[1])
+		if length == 0:
+			distances = np.hypot(vectors[:, 0], vectors[:, 1])
+		else:
+			distances = np.abs(segment[0] * vectors[:, 1] - segment[1] * vectors[:, 0]) / length
+		i = int(np.argmax(distances))
+		if distances[i] > tolerance:
+			keep[start + 1 + i] = True
+			stack.append((start, start + 1 + i))
+			stack.append((start + 1 + i, end))
+	return np.flatnonzero(keep)
+
+# The vertices where the boundaries of different rings meet or split
+def find_junctions(rings):
+	neighbours = {}
+	junctions = set()
+	for ring in rings:
+		n = len(ring) - 1
+		for i in range(n):
+			# The ring is closed, the point before the first one is the last but one
+			pair = frozenset((ring[i - 1] if i > 0 else ring[n - 1], ring[i + 1]))
+			known = neighbours.setdefault(ring[i], pair)
+			if known != pair:
+				junctions.add(ring[i])
+	return junctions
+
+# Simplifying an arc, the same arc (in either direction) always gives the same result
+def simplify_arc(arc, tolerance, cache):
+	forward = tuple(arc)
+	backward = forward[::-1]
+	key = min(forward, backward)
+	if key not in cache:
+		cache[key] = [key[i] for i in douglas_peucker(key, tolerance)]
+	simplified = cache[key]
+	return simplified if key == forward else simplified[::-1]
+
+def simplify_ring(ring, junctions, tolerance, cache):
+	points = ring[:-1]
+	cuts = [i for i, p in enumerate(points) if p in junctions]
+	if not cuts:
+		# Ring without junction (island, enclave): starting at its smallest point so that it is cut the same way everywhere
+		cuts = [points.index(min(points))]
+
+	# Rotating the ring to start at the first junction and cutting it into arcs
+	start = cuts[0]
+	points = points[start:] + points[:start]
+	cuts = [i - start for i in cuts] + [len(points)]
+	points = points + [points[0]]
+
+	simplified = [points[0]]
+	for a, b in zip(cuts[:-1], cuts[1:]):
+		simplified.extend(simplify_arc(points[a:b + 1], tolerance, cache)[1:])
+
+	# A ring too small for the tolerance is kept as is
+	if len(simplified) < 4:
+		return points
+	return simplified
+
+# Simplification of all the (Multi)Polygon features of a GeoJSON FeatureCollection, in place
+# `tolerance` in degrees, `precision` the number of decimals of the coordinates
+def simplify_geojson(geojson_dict, tolerance, precision):
+	all_rings = []
+	for feature in geojson_dict['features']:
+		for polygon in geometry_polygons(feature['geometry']):
+			for i, ring in enumerate(polygon):
+				polygon[i] = quantize_ring(ring, precision)
+				all_rings.append(polygon[i])
+
+	junctions = find_junctions(all_rings)
+	cache = {}
+	for feature in geojson_dict['features']:
+		for polygon in geometry_polygons(feature['geometry']):
+			for i, ring in enumerate(polygon):
+				polygon[i] = [list(p) for p in simplify_ring(ring, junctions, tolerance, cache)]
+
+	return geojson_dict
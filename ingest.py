@@ -0,0 +1,97 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Ingest stage: the raw CSV files are converted once into typed, column-pruned Parquet files in `data/cache/`.
+# The following runs load only the needed columns from the Parquet file instead of re-parsing the whole CSV.
+#
+# A cache file is keyed by the size and modification time of the source file (and by the dataset spec),
+# so a new release of `charging_points.csv` / `voitures.csv` is ingested again automatically.
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import glob
+import json
+import hashlib
+import pandas as pd
+
+
+CACHE_DIR = 'data/cache'
+
+# Columns kept for each dataset: `str` columns are kept as strings, `category` for the codes, `int` for the counts
+EPOINTS_SPEC = {
+	'sep': ',',
+	'columns': {
+		'adresse_station': 'str',
+		'coordonneesXY': 'str',
+		'consolidated_code_postal': 'category',
+		'created_at': 'str',
+		'id_pdc_itinerance': 'str',
+		'id_station_itinerance': 'str',
+	},
+}
+
+EVS_SPEC = {
+	'sep': ';',
+	'columns': {
+		'CODGEO': 'category',
+		'LIBGEO': 'category',
+		'EPCI': 'category',
+		'LIBEPCI': 'category',
+		'DATE_ARRETE': 'category',
+		'NB_VP_RECHARGEABLES_EL': 'int',
+	},
+}
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Cache file path for the current version of the source file
+def cache_path(source, spec, cache_dir=CACHE_DIR):
+	stat = os.stat(source)
+	key = json.dumps([stat.st_size, stat.st_mtime_ns, spec], sort_keys=True)
+	digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+	name = os.path.splitext(os.path.basename(source))[0]
+	return os.path.join(cache_dir, f'{name}.{digest}.parquet')
+
+# Converting the columns (read as strings) to their types
+def convert_types(df, spec):
+	columns = spec['columns']
+	for column, dtype in columns.items():
+		if dtype == 'category':
+			df[column] = df[column].astype('category')
+		elif dtype == 'int':
+			df[column] = pd.to_numeric(df[column], errors='coerce').astype('Int64')
+	return df[list(columns)]
+
+# Reading the raw CSV (only the needed columns) and converting the columns to their types
+def ingest_csv(source, spec):
+	df = pd.read_csv(source, sep=spec['sep'], usecols=list(spec['columns']), dtype=str)
+	return convert_types(df, spec)
+
+# Reading the raw CSV by chunks of `chunksize` rows, without caching, for the streaming pipelines
+def read_csv_chunks(source, spec, chunksize):
+	reader = pd.read_csv(source, sep=spec['sep'], usecols=list(spec['columns']), dtype=str, chunksize=chunksize)
+	for chunk in reader:
+		yield convert_types(chunk, spec)
+
+# Loading the dataset from the Parquet cache, the cache is (re)built if the source file has changed
+def load_cached_csv(source, spec, columns=None, cache_dir=CACHE_DIR):
+	path = cache_path(source, spec, cache_dir)
+	if not os.path.exists(path):
+		df = ingest_csv(source, spec)
+		os.makedirs(cache_dir, exist_ok=True)
+		# Removing the cache files of the previous versions of the source file (another process of `pipeline.py`
+		# may be removing them too, or may have just written the current one)
+		name = os.path.splitext(os.path.basename(source))[0]
+		for old_path in glob.glob(os.path.join(cache_dir, f'{name}.*.parquet')):
+			if old_path != path:
+				try:
+					os.remove(old_path)
+				except FileNotFoundError:
+					pass
+		# Written to a temporary file of this process first (the stages of `pipeline.py` can ingest the same file
+		# at the same time), an interrupted run never leaves a truncated cache behind
+		suffix = f'.{os.getpid()}.tmp'
+		df.to_parquet(path + suffix, index=False)
+		os.replace(path + suffix, path)
+		if columns is not None:
+			df = df[columns]
+		return df
+
+	return pd.read_parquet(path, columns=columns)
@@ -0,0 +1,196 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Opt-in instrumentation of the pipeline stages (preprocessing scripts and dashboard render steps).
+#
+# Disabled by default (the decorated functions only pay one check), enabled with the `PLUGIN_PROFILE` environment
+# variable or the `--profile` flag of the preprocessing scripts:
+# - `stages`: wall time, row counts in/out and memory (`tracemalloc`) of each stage, appended as JSON lines
+#	to `data/profile/stages.jsonl` and printed as a table at the end of the run
+# - `cprofile`: the same, plus a cProfile dump of the whole run in `data/profile/<script>.prof`
+#	(to open with `python -m pstats` or snakeviz)
+#
+#	python epoints_preprocess.py --profile stages
+#	PLUGIN_PROFILE=stages streamlit run map_dashboard.py
+#
+# The records are kept per thread, so each Streamlit rerun (one thread per script run) only sees its own stages,
+# shown by `debug_panel()`. The functions cached by Streamlit are only recorded when they are actually computed.
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import functools
+import warnings
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+PROFILE_ENV = 'PLUGIN_PROFILE'
+PROFILE_MODES = ['stages', 'cprofile']
+PROFILE_DIR = 'data/profile'
+STAGES_LOG = os.path.join(PROFILE_DIR, 'stages.jsonl')
+
+_mode = None
+_local = threading.local()
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def enable(mode='stages'):
+	global _mode
+	if mode not in PROFILE_MODES:
+		raise ValueError(f'Unknown profiling mode `{mode}`, expected one of {PROFILE_MODES}')
+	_mode = mode
+	if not tracemalloc.is_tracing():
+		tracemalloc.start()
+
+def is_enabled():
+	return _mode is not None
+
+# An unknown value of the environment variable only warns and leaves the instrumentation disabled: every script and
+# the dashboard import this module, a typo must not stop them (`enable()` called explicitly still raises)
+if os.environ.get(PROFILE_ENV):
+	if os.environ[PROFILE_ENV] in PROFILE_MODES:
+		enable(os.environ[PROFILE_ENV])
+	else:
+		warnings.warn(f'Unknown {PROFILE_ENV} `{os.environ[PROFILE_ENV]}`, expected one of {PROFILE_MODES}: the instrumentation stays disabled')
+
+# Stages recorded by the current thread, in the order they finished
+def get_records():
+	if not hasattr(_local, 'records'):
+		_local.records = []
+		_local.stack = []
+	return _local.records
+
+def reset():
+	get_records().clear()
+	_local.stack.clear()
+
+# Number of rows of a DataFrame / Series (or of the first item of a tuple of them), None otherwise
+def count_rows(value):
+	if isinstance(value, tuple) and value:
+		value = value[0]
+	if hasattr(value, 'shape') and len(getattr(value, 'shape')) > 0:
+		return int(value.shape[0])
+	return None
+
+# Records the stage `name`, the rows counts can be set on the yielded record (`rows_in`, `rows_out`)
+@contextmanager
+def stage(name, rows_in=None):
+	if _mode is None:
+		yield {}
+		return
+
+	records = get_records()
+	stack = _local.stack
+	record = {'stage': name, 'depth': len(stack), 'rows_in': rows_in, 'rows_out': None}
+	memory_start = tracemalloc.get_traced_memory()[0]
+	# The peak is reset for each stage: the outer stage keeps its peak so far, and the peak of the inner stage
+	# is handed over to it when it ends
+	if stack:
+		stack[-1].append(tracemalloc.get_traced_memory()[1])
+	stack.append([memory_start])
+	tracemalloc.reset_peak()
+	start = time.perf_counter()
+	try:
+		yield record
+	finally:
+		record['seconds'] = round(time.perf_counter() - start, 6)
+		memory_end, peak = tracemalloc.get_traced_memory()
+		peak = max([peak] + stack.pop()[1:])
+		if stack:
+			stack[-1].append(peak)
+		record['memory_delta_mb'] = round((memory_end - memory_start) / 1024 ** 2, 3)
+		record['peak_memory_mb'] = round((peak - memory_start) / 1024 ** 2, 3)
+		records.append(record)
+
+# Decorator version of `stage()`, the rows in/out are counted on the first argument and on the result
+def profiled(name=None):
+	def decorator(func):
+		stage_name = name or func.__name__
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if _mode is None:
+				return func(*args, **kwargs)
+			with stage(stage_name, rows_in=count_rows(args[0]) if args else None) as record:
+				result = func(*args, **kwargs)
+				record['rows_out'] = count_rows(result)
+			return result
+		return wrapper
+	return decorator
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def write_log(script, path=STAGES_LOG):
+	records = get_records()
+	if not records:
+		return
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	run = datetime.now(timezone.utc).isoformat(timespec='seconds')
+	with open(path, 'a') as f:
+		for record in records:
+			f.write(json.dumps({'script': script, 'run': run, **record}) + '\n')
+
+def print_summary():
+	print(f'{"stage":<44} {"seconds":>10} {"rows in":>12} {"rows out":>12} {"mem delta":>10} {"mem peak":>10}')
+	for record in get_records():
+		name = '  ' * record['depth'] + record['stage']
+		rows_in = '' if record['rows_in'] is None else f'{record["rows_in"]:,}'
+		rows_out = '' if record['rows_out'] is None else f'{record["rows_out"]:,}'
+		print(f'{name:<44} {record["seconds"]:>10.3f} {rows_in:>12} {rows_out:>12} {record["memory_delta_mb"]:>8.1f}MB {record["peak_memory_mb"]:>8.1f}MB')
+
+# Runs the `main()` of a script with the enabled instrumentation, then saves and prints what has been recorded
+def run_profiled(main, script):
+	if _mode is None:
+		return main()
+
+	profile = cProfile.Profile() if _mode == 'cprofile' else None
+	try:
+		with stage(script):
+			if profile is not None:
+				result = profile.runcall(main)
+			else:
+				result = main()
+	finally:
+		write_log(script)
+		print_summary()
+		print(f'The stages have been appended to `{STAGES_LOG}`')
+		if profile is not None:
+			path = os.path.join(PROFILE_DIR, f'{script}.prof')
+			os.makedirs(PROFILE_DIR, exist_ok=True)
+			profile.dump_stats(path)
+			pstats.Stats(profile).sort_stats('cumulative').print_stats(15)
+			print(f'The cProfile dump has been saved to `{path}`')
+	return result
+
+def add_profile_argument(parser):
+	parser.add_argument('--profile', choices=PROFILE_MODES, help=f'Record the time, rows and memory of each stage (same as `{PROFILE_ENV}=<mode>`)')
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# True when running inside `streamlit run`. Streamlit is already loaded then, a batch run never imports it
+def in_streamlit():
+	if 'streamlit' not in sys.modules:
+		return False
+	from streamlit.runtime import exists
+	return exists()
+
+# Debug panel in the sidebar of a Streamlit app: the stages of the current run and a preview of the given DataFrames
+# Does nothing when not running inside `streamlit run`
+def debug_panel(frames=None, title='Debug'):
+	if not in_streamlit():
+		return
+	import streamlit as st
+
+	with st.sidebar.expander(title, expanded=False):
+		records = get_records()
+		if records:
+			st.markdown('**Stages**')
+			st.dataframe([{'stage': '· ' * r['depth'] + r['stage'], 'seconds': r['seconds'], 'rows in': r['rows_in'],
+				'rows out': r['rows_out'], 'memory delta (MB)': r['memory_delta_mb'], 'peak (MB)': r['peak_memory_mb']} for r in records])
+		elif not is_enabled():
+			st.caption(f'Stage timings disabled, set `{PROFILE_ENV}=stages` to record them')
+		for name, df in (frames or {}).items():
+			st.markdown(f'**`{name}`**, rows count: `{df.shape[0]}`, columns: `{df.shape[1]}`')
+			st.dataframe(df.head(1000))
@@ -1,11 +1,21 @@
 import pandas as pd
 import numpy as np
 import streamlit as st
+import streamlit.components.v1 as components
 import folium
-from streamlit_folium import folium_static
 import altair as alt
+import os
 import json
 import plotly.graph_objects as go
+from branca.element import MacroElement
+from branca.colormap import StepColormap
+from jinja2 import Template
+from build_geojson import build_enriched_geojson, save_geojson, geojson_path, TIERS, DEFAULT_TIER, RATIO_COLORS, NAN_COLOR
+from metrics_cube import build_metrics_cube, save_metrics_cube, METRICS_CUBE, NATIONAL_CODE, NATIONAL_NAME
+from dimensions import align_cumsum, COMMUNES_DIR
+from station_bins import load_level, density_grid, density_image, zoom_level, cell_size, STATION_BINS, ZOOM_LEVELS
+import instrumentation
+from instrumentation import profiled
 
 # Page configuration
 st.set_page_config(
@@ -17,153 +27,462 @@ st.set_page_config(
 )
 
 alt.theme.enable('dark')
+
+# MEMOISATION PER SELECTION
+# There are only about 97 departments (+ 'France entière') x 6 years, so the results of a selection are cached
+# (`st.cache_data` is shared between all the sessions of the app, the least recently used entries are evicted)
+SELECTION_CACHE_SIZE = 1024
+# The map HTML embeds the whole GeoJSON, fewer of them are kept
+MAP_CACHE_SIZE = 64
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+# Zoom of the map when it opens (France), the density layer then follows the zoom of the map (see `DensityZoom`)
+MAP_ZOOM = 6
+# Colors of the density layer, from the fewest to the most charging points per cell (`YlOrRd`)
+DENSITY_COLORS = ['#ffffb2', '#fed976', '#feb24c', '#fd8d3c', '#f03b20', '#bd0026']
+
+# The layers of the cube returned by `load_datasets()`
+METRICS = ['epoints', 'evs', 'epoints_cum', 'evs_cum', 'ratio_cum']
+
+# Pivot table (see the preprocessing scripts) indexed by `dept_code`, and the department names
+def read_pivot(path):
+	df = pd.read_csv(path, dtype={'dept_code': str, 'dept_name': str}).set_index('dept_code')
+	return df.drop(columns=['dept_name', 'total'], errors='ignore'), df['dept_name']
+
 # Uploading datasets
+# All the tables are aligned on the same departments (rows) and years (columns) and stacked into one numeric array
+# `cube[metric, department, year]` (see `METRICS`), a department or a year missing from one of the datasets counts 0 there
+# (the cumulative values of the years after its last year are its last total)
 @st.cache_data
+@profiled()
 def load_datasets():
-	epoints_actual = pd.read_csv('data/epoints_pivot.csv')
-	epoints_actual['dept_code_name'] = epoints_actual['dept_code'] + ' - ' + epoints_actual['dept_name']
-	epoints_actual.insert(2, '2020', 0)
-
-	epoints_cum = pd.read_csv('data/epoints_pivot_cumsum.csv')
-	epoints_cum['dept_code_name'] = epoints_cum['dept_code'] + ' - ' + epoints_cum['dept_name']
-	epoints_cum.insert(2, '2020', 0)
-
-	evs_actual = pd.read_csv('data/evs_pivot.csv')
-	evs_actual['dept_code_name'] = evs_actual['dept_code'] + ' - ' + evs_actual['dept_name']
-
-	evs_cum = pd.read_csv('data/evs_pivot_cumsum.csv')
-	evs_cum['dept_code_name'] = evs_cum['dept_code'] + ' - ' + evs_cum['dept_name']
-
-	# Calculating the ratio of electric vehicles per charging point as the new dataframe
-	ratio_cum = evs_cum.copy()
-	for column in evs_cum.columns:
-		if column not in ['dept_code', 'dept_name', 'dept_code_name']:
-			ratio_cum[column] = evs_cum[column].div(epoints_cum[column]).replace([np.inf, -np.inf], np.nan).fillna(0).astype(int)
-	
-	return epoints_actual, evs_actual, epoints_cum, evs_cum, ratio_cum
+	tables = {}
+	names = []
+	for metric, path in [('epoints', 'data/epoints_pivot.csv'), ('evs', 'data/evs_pivot.csv'),
+			('epoints_cum', 'data/epoints_pivot_cumsum.csv'), ('evs_cum', 'data/evs_pivot_cumsum.csv')]:
+		tables[metric], dept_names = read_pivot(path)
+		names.append(dept_names)
+
+	dept_names = pd.concat(names)
+	dept_names = dept_names[~dept_names.index.duplicated()].sort_index()
+	depts = dept_names.to_frame('dept_name')
+	depts['dept_code_name'] = depts.index + ' - ' + depts['dept_name']
+	years = sorted(set().union(*(table.columns for table in tables.values())), key=int)
+
+	cube = np.zeros((len(METRICS), len(depts), len(years)), dtype=np.int64)
+	for metric in ['epoints', 'evs']:
+		cube[METRICS.index(metric)] = tables[metric].reindex(index=depts.index, columns=years, fill_value=0).to_numpy()
+	# The cumulative values keep their last total after the last year of their dataset (see `align_cumsum()`)
+	for metric in ['epoints_cum', 'evs_cum']:
+		cube[METRICS.index(metric)] = align_cumsum(tables[metric], depts.index, years).to_numpy()
+
+	# Ratio of electric vehicles per charging point, 0 where there is no charging point
+	epoints_cum = cube[METRICS.index('epoints_cum')]
+	evs_cum = cube[METRICS.index('evs_cum')]
+	np.floor_divide(evs_cum, epoints_cum, out=cube[METRICS.index('ratio_cum')], where=epoints_cum != 0)
+
+	return depts, years, cube
+
+# One layer of the cube as a DataFrame (a view on the array, no copy)
+def cube_frame(depts, years, cube, metric):
+	return pd.DataFrame(cube[METRICS.index(metric)], index=depts.index, columns=years, copy=False)
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 # def ft_sidebar(df):
-def ft_sidebar(df_epoints, df_evs):
+def ft_sidebar(depts, years):
 	with st.sidebar:
 		# year_list = ['2024', '2023', '2022', '2021', '2020']
 		# selected_year = st.selectbox('Select year', year_list)
-		year_list = [2024, 2023, 2022, 2021, 2020]
-		selected_year = str(st.slider('Select year', min(year_list), max(year_list), value=max(year_list)))
+		# The years found in the datasets (see `load_datasets()`)
+		# Animation mode: every year is sent once to the browser (map and bar charts), moving through the years
+		# does not rerun the app. The values shown outside of the charts are the ones of the last year
+		animate = st.toggle('Animate the years in the browser')
+		year_list = [int(year) for year in years]
+		if animate:
+			selected_year = years[-1]
+		else:
+			selected_year = str(st.slider('Select year', min(year_list), max(year_list), value=max(year_list)))
 		# year_list = ['2020', '2021', '2022', '2023', '2024']
 		# selected_year = st.radio('Select year', year_list)
 		
-		dept_list = list(df_epoints['dept_code_name'].unique())
+		dept_list = list(depts['dept_code_name'])
 		dept_list.insert(0, 'France entière')
 		selected_department = st.radio(':fr: Select department :fr:', dept_list)
 		# selected_department = st.selectbox(':fr: Select department :fr:', dept_list)
 
-	return selected_year, selected_department
+		# Level of detail of the departments boundaries, `low` for mobile and slow connections
+		tier_list = list(TIERS)
+		selected_tier = st.selectbox('Map detail', tier_list, index=tier_list.index(DEFAULT_TIER))
+
+	return selected_year, selected_department, selected_tier, animate
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# The departments GeoJSON with the values of every year already embedded in the properties (see `build_geojson.py`)
+# One file per level of detail `tier`, loaded once and shared between the reruns and the sessions, only read afterwards.
+# The file is rebuilt when it was built for other `years` than the ones of the datasets (or without the fill colors)
+@st.cache_resource
+@profiled()
+def load_geojson(tier, years, mtime=None):
+	if os.path.exists(geojson_path(tier)):
+		with open(geojson_path(tier)) as f:
+			geojson_dict = json.load(f)
+		if geojson_dict.get('years') == list(years) and 'ratio_bins' in geojson_dict:
+			return geojson_dict
+	geojson_dict = build_enriched_geojson(tier)
+	save_geojson(geojson_dict, tier)
+	return geojson_dict
+
+def get_geojson(tier, years):
+	# The modification time is part of the cache key so a rebuilt file is picked up without restarting the app
+	mtime = os.path.getmtime(geojson_path(tier)) if os.path.exists(geojson_path(tier)) else None
+	return load_geojson(tier, tuple(years), mtime)
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-# def create_choropleth(map, df, column, color, legend_name):
-def create_choropleth(map, df_points, df_evs, ratio_cum, column, color, legend_name):
-	# Converting the dataframe to a dictionarya to add a value to the GeoJSON file to use withthe tooltip
-	df_points_dict = df_points.set_index('dept_code')[column].to_dict()
-	df_evs_dict = df_evs.set_index('dept_code')[column].to_dict()
-	df_ratio_cum_dict = ratio_cum.set_index('dept_code')[column].to_dict()
-
-	with open('data/france_departments.geojson') as f:
-		geojson_dict = json.load(f)
-	
-	for feature in geojson_dict['features']:
-		feature['properties']['e_charge'] = df_points_dict.get(feature['properties']['code'], 'N/A')
-		feature['properties']['vehicles'] = df_evs_dict.get(feature['properties']['code'], 'N/A')
-		feature['properties']['ratio'] = df_ratio_cum_dict.get(feature['properties']['code'], 'N/A')
-	
-	choropleth = folium.Choropleth(
-		geo_data=geojson_dict,
+# Legend of the ratio colors, the same classes for all the years (see `build_geojson.py`)
+def ratio_colormap(geojson_dict, caption):
+	bins = geojson_dict['ratio_bins']
+	return StepColormap(RATIO_COLORS, index=bins, vmin=bins[0], vmax=bins[-1], caption=caption)
+
+# The departments of `ratio_cum` colored for the year `column`, the others as the missing values.
+# The fill colors and the values shown in the tooltip are already in the GeoJSON properties, suffixed by the year:
+# the colors are the ones of the animated map (`fill_<year>`, one scale for all the years)
+@profiled()
+def create_choropleth(map, ratio_cum, column, legend_name, tier=DEFAULT_TIER):
+	geojson_dict = get_geojson(tier, ratio_cum.columns)
+	codes = set(ratio_cum.index)
+
+	def style(feature):
+		p = feature['properties']
+		return {'fillColor': p[f'fill_{column}'] if p['code'] in codes else NAN_COLOR, 'fillOpacity': 0.7, 'color': 'black', 'weight': 1, 'opacity': 0.2}
+
+	folium.GeoJson(
+		geojson_dict,
 		name=legend_name,
-		data=ratio_cum,
-		columns=['dept_code', column],
-		key_on='feature.properties.code',
-		fill_color=color,
-		fill_opacity=0.7,
-		line_opacity=0.2,
-		legend_name=legend_name,
+		style_function=style,
+		tooltip=folium.features.GeoJsonTooltip(['code', 'nom', f'ratio_{column}', f'vehicles_{column}', f'e_charge_{column}'], aliases=['départ. code: ', 'département: ', 'vé par départ: ', 'véhicules él.: ', 'bornes: ']),
 	).add_to(map)
-
-	choropleth.geojson.add_child(
-		folium.features.GeoJsonTooltip(['code', 'nom', 'ratio', 'vehicles', 'e_charge'], aliases=['départ. code: ', 'département: ', 'vé par départ: ', 'véhicules él.: ', 'bornes: '])
-	)
+	ratio_colormap(geojson_dict, legend_name).add_to(map)
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-# COLOR SCHEMES FOR CHOROPLETH MAPS:
-# 'BuGn', `BuPu`,`GnBu`,`OrRd`,`PuBu`,`PuBuGn`,`PuRd`,`RdPu`,`YlGn`,`YlGnBu`,`YlOrBr`,`YlOrRd`,
-# `Blues`, `Greens`, `Greys`, `Oranges`, `Purples`, `Reds` 
-# `Accent`, `Dark2`, `Paired`, `Pastel1`, `Pastel2`, `Set1`, `Set2`, `Set3`
-def render_map(df_epoints, df_evs, ratio_cum, selected_year):
+@profiled()
+def create_map(ratio_cum, selected_year, selected_tier=DEFAULT_TIER, dept_code=None):
 
 	map = folium.Map(
     	location=[46.603354, 1.8883344], 
-    	zoom_start=6, 
+    	zoom_start=MAP_ZOOM, 
     	tiles='CartoDB positron', 
     	scrollWheelZoom=False,
 		control_scale=False
 	)
 
-	create_choropleth(map, df_epoints, df_evs, ratio_cum, selected_year, 'Set3', 'Véhicules électriques par borne de recharge')
+	create_choropleth(map, ratio_cum, selected_year, 'Véhicules électriques par borne de recharge', selected_tier)
+	create_density_layer(map, selected_year, dept_code)
+
+	folium.LayerControl().add_to(map)
+	return map
+
+@st.cache_data(max_entries=MAP_CACHE_SIZE)
+@profiled()
+def build_map_html(selected_department, selected_year, selected_tier):
+	_, _, df_ratio_cum = select_department(selected_department)
+	dept_code = None if selected_department == 'France entière' else selected_department.split(' - ')[0]
+	map = create_map(df_ratio_cum, selected_year, selected_tier, dept_code)
+	# Same as `folium_static()` does before handing the HTML to the browser
+	return folium.Figure().add_child(map).render()
+
+# The rendered HTML is memoised per selection (see `build_map_html()`), `render_map()` only displays it
+@profiled()
+def render_map(selected_department, selected_year, selected_tier=DEFAULT_TIER):
+	components.html(build_map_html(selected_department, selected_year, selected_tier), width=800, height=810)
+	if os.path.exists(geojson_path(selected_tier)):
+		st.caption(f'Niveau de détail de la carte : `{selected_tier}` ({os.path.getsize(geojson_path(selected_tier)) / 1024:,.0f} KB)')
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# ANIMATED MAP
+# All the years in one map: the fill color and the tooltip values of every year are already in the GeoJSON properties
+# (`fill_<year>`, `ratio_<year>`, ... see `build_geojson.py`), a slider on the map only switches the properties shown.
+# Only the selected department is colored (the others as the missing values, like `create_choropleth()`)
+class YearSlider(MacroElement):
+	_template = Template("""
+	{% macro script(this, kwargs) %}
+	(function() {
+		var layer = {{ this.layer.get_name() }};
+		var years = {{ this.years|tojson }};
+		var selected = {{ this.selected|tojson }};
+		var control = L.control({position: 'bottomleft'});
+		var label, input, button, timer = null;
+
+		function show(index) {
+			var year = years[index];
+			label.textContent = year;
+			layer.setStyle(function(feature) {
+				var p = feature.properties;
+				return {fillColor: selected === null || p.code === selected ? p['fill_' + year] : '{{ this.nan_color }}',
+					fillOpacity: 0.7, color: 'black', weight: 1, opacity: 0.2};
+			});
+			layer.eachLayer(function(l) {
+				var p = l.feature.properties;
+				l.setTooltipContent('départ. code: ' + p.code + '<br>département: ' + p.nom + '<br>vé par départ: ' + p['ratio_' + year]
+					+ '<br>véhicules él.: ' + p['vehicles_' + year] + '<br>bornes: ' + p['e_charge_' + year]);
+			});
+		}
+
+		control.onAdd = function() {
+			var div = L.DomUtil.create('div');
+			div.style.cssText = 'background: white; padding: 6px 10px; border-radius: 4px; font: 14px sans-serif;';
+			div.innerHTML = '<button type="button">&#9654;</button> <b></b><br><input type="range" min="0" step="1" style="width: 220px;">';
+			button = div.querySelector('button');
+			label = div.querySelector('b');
+			input = div.querySelector('input');
+			input.max = years.length - 1;
+			input.value = years.length - 1;
+			L.DomEvent.disableClickPropagation(div);
+			input.addEventListener('input', function() { show(+input.value); });
+			button.addEventListener('click', function() {
+				if (timer !== null) { clearInterval(timer); timer = null; return; }
+				timer = setInterval(function() {
+					input.value = (+input.value + 1) % years.length;
+					show(+input.value);
+				}, 1000);
+			});
+			return div;
+		};
+		control.addTo({{ this._parent.get_name() }});
+		layer.eachLayer(function(l) { l.bindTooltip(''); });
+		show(years.length - 1);
+	})();
+	{% endmacro %}
+	""")
+
+	def __init__(self, layer, years, selected=None, nan_color='#000000'):
+		super().__init__()
+		self._name = 'YearSlider'
+		self.layer = layer
+		self.years = list(years)
+		self.selected = selected
+		self.nan_color = nan_color
+
+@profiled()
+def create_animated_map(years, tier=DEFAULT_TIER, dept_code=None):
+	geojson_dict = get_geojson(tier, years)
+
+	map = folium.Map(
+		location=[46.603354, 1.8883344],
+		zoom_start=MAP_ZOOM,
+		tiles='CartoDB positron',
+		scrollWheelZoom=False,
+		control_scale=False
+	)
+	layer = folium.GeoJson(geojson_dict, name='Véhicules électriques par borne de recharge').add_to(map)
+	YearSlider(layer, years, dept_code, NAN_COLOR).add_to(map)
+	ratio_colormap(geojson_dict, 'Véhicules électriques par borne de recharge').add_to(map)
+	create_density_layer(map, years[-1], dept_code)
 
 	folium.LayerControl().add_to(map)
-	folium_static(map, width=800, height=800)
+	return map
+
+# One HTML per department / tier for all the years
+@st.cache_data(max_entries=MAP_CACHE_SIZE)
+@profiled()
+def build_animated_map_html(selected_department, selected_tier):
+	_, years, _ = load_datasets()
+	dept_code = None if selected_department == 'France entière' else selected_department.split(' - ')[0]
+	map = create_animated_map(years, selected_tier, dept_code)
+	return folium.Figure().add_child(map).render()
+
+@profiled()
+def render_animated_map(selected_department, selected_tier=DEFAULT_TIER):
+	components.html(build_animated_map_html(selected_department, selected_tier), width=800, height=810)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# DENSITY LAYER
+# The charging points counted in square cells by the preprocessing (see `station_bins.py`), each level is read once
+# and shared between the reruns and the sessions
+@st.cache_resource
+@profiled()
+def load_station_level(level, mtime=None):
+	return load_level(level)
+
+def get_station_level(zoom):
+	# The modification time is part of the cache key so a rebuilt file is picked up without restarting the app
+	return load_station_level(zoom_level(zoom), os.path.getmtime(STATION_BINS))
+
+# Shows only the image of the level matching the zoom of the map (the nearest one, see `zoom_level()`) in the density
+# layer, again on every zoom of the map. Runs in the browser, the map is not rendered again
+class DensityZoom(MacroElement):
+	_template = Template("""
+	{% macro script(this, kwargs) %}
+	(function() {
+		var map = {{ this._parent.get_name() }};
+		var group = {{ this.group.get_name() }};
+		var images = { {%- for level, image in this.images.items() %}{{ level }}: {{ image.get_name() }}, {% endfor -%} };
+		var levels = {{ this.images.keys()|list|tojson }};
+
+		function show() {
+			var zoom = map.getZoom();
+			var level = levels.reduce(function(nearest, l) { return Math.abs(l - zoom) < Math.abs(nearest - zoom) ? l : nearest; });
+			levels.forEach(function(l) {
+				if (l === level) { group.addLayer(images[l]); } else { group.removeLayer(images[l]); }
+			});
+		}
+		map.on('zoomend', show);
+		show();
+	})();
+	{% endmacro %}
+	""")
+
+	def __init__(self, group, images):
+		super().__init__()
+		self._name = 'DensityZoom'
+		self.group = group
+		self.images = images
+
+# Cumulative number of charging points per cell up to the selected year (of the selected department), drawn as one
+# image per level instead of one marker per charging point. Hidden by default, shown from the layer control
+@profiled()
+def create_density_layer(map, selected_year, dept_code=None):
+	if not os.path.exists(STATION_BINS):
+		return
+	cells_km = [cell_size(level) * 111 for level in ZOOM_LEVELS]
+	group = folium.FeatureGroup(name=f'Densité des bornes (cellules de ~{max(cells_km):,.0f} à ~{min(cells_km):,.1f} km selon le zoom)', show=False).add_to(map)
+	images = {}
+	for level in ZOOM_LEVELS:
+		grid, bounds = density_grid(get_station_level(level), level, selected_year, dept_code)
+		image, _ = density_image(grid, DENSITY_COLORS)
+		images[level] = folium.raster_layers.ImageOverlay(image, bounds, mercator_project=True, opacity=0.8).add_to(group)
+	DensityZoom(group, images).add_to(map)
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-def plot_barchart(df, title):
-	years = ['2020', '2021', '2022', '2023', '2024']
+# The figure does not depend on the selection, it is built once and shared between the reruns and the sessions
+@st.cache_data(max_entries=SELECTION_CACHE_SIZE)
+@profiled()
+def build_barchart(metric, title):
+	depts, years, cube = load_datasets()
+	df = cube_frame(depts, years, cube, metric)
 	data = []
 	for year in years:
-		data.append(go.Bar(name=year, x=df['dept_code_name'], y=df[year]))
+		data.append(go.Bar(name=year, x=depts['dept_code_name'], y=df[year]))
 	fig = go.Figure(data=data)
 	fig.update_layout(barmode='stack', title=title)
+	return fig
+
+# Same chart with one animation frame per year: the frame of a year only stacks the years up to it.
+# All the frames are in the figure, the play button and the slider of the chart run in the browser
+@st.cache_data(max_entries=SELECTION_CACHE_SIZE)
+@profiled()
+def build_animated_barchart(metric, title):
+	depts, years, cube = load_datasets()
+	df = cube_frame(depts, years, cube, metric)
+	zeros = np.zeros(len(df), dtype=np.int64)
+
+	def bars(last_year):
+		return [go.Bar(name=year, x=depts['dept_code_name'], y=df[year] if year <= last_year else zeros) for year in years]
+
+	frames = [go.Frame(data=bars(year), name=year) for year in years]
+	fig = go.Figure(data=frames[-1].data, frames=frames)
+	step = {'frame': {'duration': 800, 'redraw': True}, 'transition': {'duration': 300}, 'mode': 'immediate'}
+	fig.update_layout(
+		barmode='stack',
+		title=title,
+		# The axis of the last year for all the frames, so the bars grow instead of the axis changing
+		yaxis={'range': [0, df.sum(axis=1).max() * 1.05]},
+		updatemenus=[{'type': 'buttons', 'showactive': False, 'x': 0, 'y': -0.25, 'xanchor': 'left',
+			'buttons': [{'label': '▶', 'method': 'animate', 'args': [None, {**step, 'fromcurrent': True}]}]}],
+		sliders=[{'active': len(years) - 1, 'x': 0.05, 'y': -0.2, 'len': 0.95,
+			'steps': [{'label': year, 'method': 'animate', 'args': [[year], step]} for year in years]}],
+	)
+	return fig
+
+@profiled()
+def plot_barchart(metric, title, animate=False):
+	fig = build_animated_barchart(metric, title) if animate else build_barchart(metric, title)
 	st.plotly_chart(fig, use_container_width=True, height=600)
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-# This function calculates the change in values between the selected year and the previous year
-def calculate_delta(df_epoints_cum, df_evs_cum, selected_year):
-	# Calculating the values for the selected year
-	epoints_current = df_epoints_cum[selected_year].sum()
-	evs_current = df_evs_cum[selected_year].sum()
-	ratio_current = int(evs_current/epoints_current) if epoints_current != 0 else evs_current
-
-	# Calculating the values for the previous year
-	previous_year = str(int(selected_year) - 1)
-	epoints_previous = df_epoints_cum[previous_year].sum() if previous_year in df_epoints_cum.columns else 0
-	evs_previous = df_evs_cum[previous_year].sum() if previous_year in df_evs_cum.columns else 0
-	ratio_previous = int(evs_previous/epoints_previous) if epoints_previous != 0 else evs_previous
-
-	# Calculating the delta between the selected year and the previous year
-	delta_epoints = epoints_current - epoints_previous
-	delta_evs = evs_current - evs_previous
-	delta_ratio = ratio_current - ratio_previous
-
-	return epoints_current, evs_current, ratio_current, delta_epoints, delta_evs, delta_ratio
+# Cumulative tables (charging points, vehicles, ratio) of the selected department, or of all of them
+@st.cache_data(max_entries=SELECTION_CACHE_SIZE)
+@profiled()
+def select_department(selected_department):
+	depts, years, cube = load_datasets()
+	df_epoints_cum, df_evs_cum, df_ratio_cum = [cube_frame(depts, years, cube, metric) for metric in ['epoints_cum', 'evs_cum', 'ratio_cum']]
+
+	if selected_department != 'France entière':
+		selected_code = depts.index[depts['dept_code_name'] == selected_department]
+		df_epoints_cum = df_epoints_cum.loc[selected_code]
+		df_evs_cum = df_evs_cum.loc[selected_code]
+		df_ratio_cum = df_ratio_cum.loc[selected_code]
+
+	return df_epoints_cum, df_evs_cum, df_ratio_cum
+
+# COMMUNES DRILL-DOWN
+# The EVs per commune of one department, read from its own file only when the department is selected
+# (see `vehicles_preprocess.save_communes()`), nothing is loaded for 'France entière'
+@st.cache_data(max_entries=SELECTION_CACHE_SIZE)
+@profiled()
+def load_communes(dept_code, mtime=None):
+	return pd.read_parquet(os.path.join(COMMUNES_DIR, f'{dept_code}.parquet'))
+
+# Cumulative number of EVs of each commune up to the selected year, and the new ones of the year
+@profiled()
+def select_communes(selected_department, selected_year):
+	dept_code = selected_department.split(' - ')[0]
+	path = os.path.join(COMMUNES_DIR, f'{dept_code}.parquet')
+	if not os.path.exists(path):
+		return None
+	communes = load_communes(dept_code, os.path.getmtime(path))
+	year_columns = [column for column in communes.columns if column.isdigit() and column <= selected_year]
+	df = communes[['libgeo', 'libepci']].copy()
+	df['evs_cum'] = communes[year_columns].sum(axis=1)
+	df['evs'] = communes[selected_year] if selected_year in communes.columns else 0
+	return df.sort_values('evs_cum', ascending=False)
+
+@profiled()
+def render_communes(selected_department, selected_year):
+	df = select_communes(selected_department, selected_year)
+	if df is None:
+		return
+	st.header(f"Véhicules électriques par commune, cumulatif ({selected_year}) :")
+	st.dataframe(
+		df.rename(columns={'libgeo': 'commune', 'libepci': 'EPCI', 'evs_cum': 'véhicules él.', 'evs': f'nouveaux en {selected_year}'}),
+		use_container_width=True,
+	)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Metrics of every department (and of 'France entière') and year, precomputed by the preprocessing (see `metrics_cube.py`)
+# keyed by (department as shown in the sidebar, year)
+@st.cache_data
+@profiled()
+def load_metrics():
+	if not os.path.exists(METRICS_CUBE):
+		save_metrics_cube(build_metrics_cube())
+	cube = pd.read_csv(METRICS_CUBE, dtype={'dept_code': str, 'dept_name': str, 'year': str})
+	keys = (cube['dept_code'] + ' - ' + cube['dept_name']).where(cube['dept_code'] != NATIONAL_CODE, NATIONAL_NAME)
+	values = cube[['epoints', 'evs', 'ratio', 'delta_epoints', 'delta_evs', 'delta_ratio']].to_numpy().tolist()
+	return dict(zip(zip(keys, cube['year']), map(tuple, values)))
+
+# The values for the selected year and their change since the previous year:
+# (epoints, evs, ratio, delta_epoints, delta_evs, delta_ratio)
+@profiled()
+def get_metrics(selected_department, selected_year):
+	return load_metrics().get((selected_department, selected_year), (0, 0, 0, 0, 0, 0))
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 def main():
+	# Stage timings of this rerun (`PLUGIN_PROFILE=stages streamlit run map_dashboard.py`, see `instrumentation.py`)
+	instrumentation.reset()
+
 	# Load the data
-	df_epoints, df_evs, df_epoints_cum, df_evs_cum, df_ratio_cum = load_datasets()
+	depts, years, cube = load_datasets()
 
-	selected_year, selected_department = ft_sidebar(df_epoints_cum, df_evs_cum)
+	selected_year, selected_department, selected_tier, animate = ft_sidebar(depts, years)
 
 	st.title("DASHBOARD")
 
-	if selected_department != 'France entière':
-		df_epoints_cum = df_epoints_cum[df_epoints_cum['dept_code_name'] == selected_department]
-		df_evs_cum = df_evs_cum[df_evs_cum['dept_code_name'] == selected_department]
-		df_ratio_cum = df_ratio_cum[df_ratio_cum['dept_code_name'] == selected_department]
-	
-	# Calculating the delta between the selected year and the previous year
-	epoints_current, evs_current, ratio_current, delta_epoints, delta_evs, delta_ratio = calculate_delta(df_epoints_cum, df_evs_cum, selected_year)
+	# The values and their change between the selected year and the previous year (precomputed)
+	epoints_current, evs_current, ratio_current, delta_epoints, delta_evs, delta_ratio = get_metrics(selected_department, selected_year)
 
 	st.header("Véhicules électriques par borne de rechargei cumulatif :")
 
@@ -178,11 +497,21 @@ def main():
 		st.markdown("### Bornes de recharge")
 		st.metric(label=selected_department, value='{:,}'.format(epoints_current), delta='{:,}'.format(int(delta_epoints)))
 
-	render_map(df_epoints_cum, df_evs_cum, df_ratio_cum, selected_year)
+	if animate:
+		render_animated_map(selected_department, selected_tier)
+	else:
+		render_map(selected_department, selected_year, selected_tier)
+
+	if selected_department != 'France entière':
+		render_communes(selected_department, selected_year)
 
 	st.header(":electric_plug: Bornes de recharge et Véhicules électriques en France :car:")
-	plot_barchart(df_epoints, 'Bornes de recharge par département, cumulatif :')
-	plot_barchart(df_evs, 'Véhicules électriques par département, cumulatif :')
+	plot_barchart('epoints', 'Bornes de recharge par département, cumulatif :', animate)
+	plot_barchart('evs', 'Véhicules électriques par département, cumulatif :', animate)
+
+	if instrumentation.is_enabled():
+		instrumentation.write_log('map_dashboard')
+		instrumentation.debug_panel({'metrics cube': cube_frame(depts, years, cube, 'ratio_cum')})
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -0,0 +1,95 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Precomputed metrics shown by the dashboard `data/metrics_cube.csv`, one row per department (plus the national
+# row `FR` - 'France entière') and year, with the cumulative number of charging points `epoints`, of electric
+# vehicles `evs`, their ratio `ratio` and the changes since the previous year `delta_*`.
+#
+# The ratio is computed the same way for the departments and for France: integer part of evs / epoints,
+# 0 where there is no charging point.
+#
+# It is rebuilt at the end of `epoints_preprocess.py` and `vehicles_preprocess.py` (as soon as both outputs exist),
+# or by hand:
+#	python metrics_cube.py
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import pandas as pd
+import numpy as np
+from dimensions import align_cumsum
+
+
+METRICS_CUBE = 'data/metrics_cube.csv'
+EPOINTS_CUMSUM = 'data/epoints_pivot_cumsum.csv'
+EVS_CUMSUM = 'data/evs_pivot_cumsum.csv'
+NATIONAL_CODE = 'FR'
+NATIONAL_NAME = 'France entière'
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def load_cumsum(path):
+	df = pd.read_csv(path, dtype={'dept_code': str, 'dept_name': str})
+	return df.set_index('dept_code')
+
+def ratio(evs, epoints):
+	return np.floor_divide(evs, epoints, out=np.zeros_like(evs), where=epoints != 0)
+
+# Cumulative values per department (rows) and year (columns) for the charging points, the vehicles and their ratio
+# Both tables are aligned on the same departments and years (see `align_cumsum()`): the totals of a dataset ending
+# before the other one are carried over to the following years
+def load_values():
+	epoints_cum = load_cumsum(EPOINTS_CUMSUM)
+	evs_cum = load_cumsum(EVS_CUMSUM)
+
+	dept_names = pd.concat([epoints_cum['dept_name'], evs_cum['dept_name']])
+	dept_names = dept_names[~dept_names.index.duplicated()].sort_index()
+	epoints_cum = epoints_cum.drop(columns='dept_name')
+	evs_cum = evs_cum.drop(columns='dept_name')
+
+	years = sorted(set(epoints_cum.columns) | set(evs_cum.columns), key=int)
+	epoints_cum = align_cumsum(epoints_cum, dept_names.index, years)
+	evs_cum = align_cumsum(evs_cum, dept_names.index, years)
+	ratio_cum = pd.DataFrame(ratio(evs_cum.to_numpy(), epoints_cum.to_numpy()), index=dept_names.index, columns=years)
+
+	return years, dept_names, epoints_cum, evs_cum, ratio_cum
+
+def build_metrics_cube():
+	years, dept_names, epoints_cum, evs_cum, _ = load_values()
+
+	# National row: the sums over all the departments
+	epoints_cum.loc[NATIONAL_CODE] = epoints_cum.sum()
+	evs_cum.loc[NATIONAL_CODE] = evs_cum.sum()
+	dept_names[NATIONAL_CODE] = NATIONAL_NAME
+
+	# Values of the previous year, from the forward filled cumulative tables (0 before the first year)
+	previous_years = [str(int(year) - 1) for year in years]
+	epoints_previous = align_cumsum(epoints_cum, epoints_cum.index, previous_years).to_numpy()
+	evs_previous = align_cumsum(evs_cum, evs_cum.index, previous_years).to_numpy()
+
+	epoints = epoints_cum.to_numpy()
+	evs = evs_cum.to_numpy()
+	ratio_current = ratio(evs, epoints)
+	layers = {
+		'epoints': epoints,
+		'evs': evs,
+		'ratio': ratio_current,
+		'delta_epoints': epoints - epoints_previous,
+		'delta_evs': evs - evs_previous,
+		'delta_ratio': ratio_current - ratio(evs_previous, epoints_previous),
+	}
+
+	index = pd.MultiIndex.from_product([epoints_cum.index, years], names=['dept_code', 'year'])
+	cube = pd.DataFrame({name: layer.ravel() for name, layer in layers.items()}, index=index).reset_index()
+	cube.insert(1, 'dept_name', cube['dept_code'].map(dept_names))
+	return cube
+
+def save_metrics_cube(cube):
+	cube.to_csv(METRICS_CUBE, index=False)
+
+# Called at the end of the preprocessing scripts, the cube needs the outputs of both of them
+def update_metrics_cube():
+	if not (os.path.exists(EPOINTS_CUMSUM) and os.path.exists(EVS_CUMSUM)):
+		return
+	save_metrics_cube(build_metrics_cube())
+	print(f'The metrics cube has been saved to `{METRICS_CUBE}`')
+
+
+if __name__ == '__main__':
+	update_metrics_cube()
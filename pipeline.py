@@ -0,0 +1,325 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Single entry point refreshing everything the dashboard needs, instead of running the scripts by hand:
+#	python pipeline.py
+#
+# Each stage in `STAGES` declares the files it reads and writes, the stages are chained through these files:
+#	charging_points.csv -> epoints_clean -> epoints_dept -> epoints_pivot -> epoints_cumsum --+--> metrics_cube
+#	voitures.csv -------------------------> evs_dept -----> evs_pivot -----> evs_cumsum -----+--> geojson
+#	epoints_clean + epoints_dept -> station_bins, evs_dept -> evs_communes
+#	charging_points.csv + epoints_clean -> epoints_quality, voitures.csv -> evs_quality (data quality reports)
+#	epoints_pivot also saves the state of `epoints_preprocess.py --incremental` (`data/epoints_state.parquet`)
+#
+# A stage is skipped when the content of its inputs and of its code is the same as at its last successful run
+# (SHA-256 digests kept in `data/pipeline/manifest.json`, a file is only hashed again when its size or mtime changed).
+# The stages ready to run are executed concurrently in separate processes, so the charging points and the vehicles
+# branches run side by side. The intermediate tables are kept in `data/pipeline/` as Parquet files.
+#
+# The reverse geocoding `extract_geocode.py` calls a paid API, it only runs with `--geocode`.
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from build_geojson import TIERS, geojson_path
+
+
+PIPELINE_DIR = 'data/pipeline'
+MANIFEST_PATH = os.path.join(PIPELINE_DIR, 'manifest.json')
+EPOINTS_CLEAN = os.path.join(PIPELINE_DIR, 'epoints_clean.parquet')
+EPOINTS_DEPT = os.path.join(PIPELINE_DIR, 'epoints_dept.parquet')
+EVS_DEPT = os.path.join(PIPELINE_DIR, 'evs_dept.parquet')
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# STAGES
+# The imports are done in the stages: each one runs in its own process and only loads what it needs
+
+def run_epoints_clean(options):
+	from epoints_preprocess import load_dataset, process_missing_postal_codes, hash_rows
+	epoints = load_dataset()
+	df = process_missing_postal_codes(epoints, workers=options['workers'])
+	df['row_hash'] = hash_rows(epoints)
+	df.to_parquet(EPOINTS_CLEAN)
+
+def run_epoints_dept(options):
+	from epoints_preprocess import adding_department
+	adding_department(pd.read_parquet(EPOINTS_CLEAN)).to_parquet(EPOINTS_DEPT)
+
+# The state of `epoints_preprocess.py --incremental` is saved along with the pivot table, so an incremental run
+# after the pipeline starts from the same rows
+def run_epoints_pivot(options):
+	from epoints_preprocess import transform_data, state_rows, save_state
+	df_dept = pd.read_parquet(EPOINTS_DEPT)
+	transform_data(df_dept, options['count']).to_csv('data/epoints_pivot.csv')
+	df = pd.read_parquet(EPOINTS_CLEAN)
+	save_state(state_rows(df, df_dept, df['row_hash']), options['count'])
+
+def run_epoints_cumsum(options):
+	from dimensions import cumsum_pivot
+	pivot_df = pd.read_csv('data/epoints_pivot.csv', dtype={'dept_code': str, 'dept_name': str}, index_col=['dept_code', 'dept_name'])
+	cumsum_pivot(pivot_df).to_csv('data/epoints_pivot_cumsum.csv')
+
+def run_station_bins(options):
+	from station_bins import build_station_bins, save_station_bins
+	df = pd.read_parquet(EPOINTS_CLEAN, columns=['lat', 'lon']).join(pd.read_parquet(EPOINTS_DEPT), how='inner')
+	save_station_bins(build_station_bins(df))
+
+def run_epoints_quality(options):
+	from epoints_preprocess import load_dataset
+	from data_quality import epoints_report, save_report
+	save_report(epoints_report(load_dataset(), pd.read_parquet(EPOINTS_CLEAN, columns=['postal_code'])))
+
+def run_evs_dept(options):
+	from vehicles_preprocess import load_dataset, adding_department
+	adding_department(load_dataset()).to_parquet(EVS_DEPT)
+
+def run_evs_pivot(options):
+	from vehicles_preprocess import transform_to_pivot
+	transform_to_pivot(pd.read_parquet(EVS_DEPT)).to_csv('data/evs_pivot.csv')
+
+def run_evs_communes(options):
+	from vehicles_preprocess import transform_to_communes, save_communes
+	save_communes(transform_to_communes(pd.read_parquet(EVS_DEPT)))
+
+def run_evs_quality(options):
+	from vehicles_preprocess import load_dataset
+	from data_quality import profile_frame, save_report, EVS_CHECKS
+	save_report(profile_frame(load_dataset(), EVS_CHECKS, 'voitures'))
+
+def run_evs_cumsum(options):
+	from dimensions import cumsum_pivot
+	df_pivot = pd.read_csv('data/evs_pivot.csv', dtype={'dept_code': str, 'dept_name': str}, index_col=['dept_code', 'dept_name'])
+	cumsum_pivot(df_pivot).to_csv('data/evs_pivot_cumsum.csv')
+
+def run_metrics_cube(options):
+	from metrics_cube import build_metrics_cube, save_metrics_cube
+	save_metrics_cube(build_metrics_cube())
+
+def run_geojson(options):
+	from build_geojson import build_enriched_geojson, save_geojson
+	for tier in TIERS:
+		save_geojson(build_enriched_geojson(tier), tier)
+
+def run_geocode(options):
+	from extract_geocode import GoogleGeocoder, GeocodeCache, get_location_data
+	from dotenv import load_dotenv
+	load_dotenv('data/.env')
+	cache = GeocodeCache()
+	try:
+		location_data = get_location_data(pd.read_csv('data/charging_points.csv', low_memory=False), GoogleGeocoder(os.getenv('GOOGLE_MAPS_API_KEY')), cache)
+	finally:
+		cache.close()
+	location_data.to_csv('data/location_data.csv', index=False)
+
+# `code`: the source files whose changes invalidate the outputs of the stage,
+# `params`: the options of the run (see `parse_args()`) which change the outputs of the stage
+STAGES = {
+	'epoints_clean': {
+		'run': run_epoints_clean,
+		'inputs': ['data/charging_points.csv', 'data/postal_code_overrides.csv'],
+		'outputs': [EPOINTS_CLEAN],
+		'code': ['epoints_preprocess.py', 'ingest.py', 'dimensions.py'],
+	},
+	'epoints_dept': {
+		'run': run_epoints_dept,
+		'inputs': [EPOINTS_CLEAN, 'data/code-postal-corse.csv', 'data/fr-ref-geo.csv'],
+		'outputs': [EPOINTS_DEPT],
+		'code': ['epoints_preprocess.py', 'dimensions.py', 'dept_index.py'],
+	},
+	'epoints_pivot': {
+		'run': run_epoints_pivot,
+		'inputs': [EPOINTS_CLEAN, EPOINTS_DEPT],
+		'outputs': ['data/epoints_pivot.csv', 'data/epoints_state.parquet', 'data/epoints_state.parquet.json'],
+		'code': ['epoints_preprocess.py', 'dimensions.py'],
+		'params': ['count'],
+	},
+	'epoints_cumsum': {
+		'run': run_epoints_cumsum,
+		'inputs': ['data/epoints_pivot.csv'],
+		'outputs': ['data/epoints_pivot_cumsum.csv'],
+		'code': ['dimensions.py'],
+	},
+	'station_bins': {
+		'run': run_station_bins,
+		'inputs': [EPOINTS_CLEAN, EPOINTS_DEPT],
+		'outputs': ['data/station_bins.npz'],
+		'code': ['station_bins.py', 'dimensions.py'],
+	},
+	'epoints_quality': {
+		'run': run_epoints_quality,
+		'inputs': ['data/charging_points.csv', EPOINTS_CLEAN, 'data/code-postal-corse.csv', 'data/fr-ref-geo.csv'],
+		'outputs': ['data/quality/charging_points.json'],
+		'code': ['data_quality.py', 'epoints_preprocess.py', 'ingest.py', 'dimensions.py', 'dept_index.py', 'station_bins.py'],
+	},
+	'evs_dept': {
+		'run': run_evs_dept,
+		'inputs': ['data/voitures.csv', 'data/code-postal-corse.csv', 'data/fr-ref-geo.csv'],
+		'outputs': [EVS_DEPT],
+		'code': ['vehicles_preprocess.py', 'ingest.py', 'dimensions.py', 'dept_index.py'],
+	},
+	'evs_pivot': {
+		'run': run_evs_pivot,
+		'inputs': [EVS_DEPT],
+		'outputs': ['data/evs_pivot.csv'],
+		'code': ['vehicles_preprocess.py', 'dimensions.py'],
+	},
+	'evs_communes': {
+		'run': run_evs_communes,
+		'inputs': [EVS_DEPT],
+		'outputs': ['data/communes/index.json'],
+		'code': ['vehicles_preprocess.py', 'dimensions.py'],
+	},
+	'evs_quality': {
+		'run': run_evs_quality,
+		'inputs': ['data/voitures.csv', 'data/code-postal-corse.csv', 'data/fr-ref-geo.csv'],
+		'outputs': ['data/quality/voitures.json'],
+		'code': ['data_quality.py', 'vehicles_preprocess.py', 'ingest.py', 'dimensions.py', 'dept_index.py', 'station_bins.py'],
+	},
+	'evs_cumsum': {
+		'run': run_evs_cumsum,
+		'inputs': ['data/evs_pivot.csv'],
+		'outputs': ['data/evs_pivot_cumsum.csv'],
+		'code': ['dimensions.py'],
+	},
+	'metrics_cube': {
+		'run': run_metrics_cube,
+		'inputs': ['data/epoints_pivot_cumsum.csv', 'data/evs_pivot_cumsum.csv'],
+		'outputs': ['data/metrics_cube.csv'],
+		'code': ['metrics_cube.py'],
+	},
+	'geojson': {
+		'run': run_geojson,
+		'inputs': ['data/france_departments.geojson', 'data/epoints_pivot_cumsum.csv', 'data/evs_pivot_cumsum.csv'],
+		'outputs': [geojson_path(tier) for tier in TIERS],
+		'code': ['build_geojson.py', 'geometry_simplify.py', 'metrics_cube.py'],
+	},
+	'geocode': {
+		'run': run_geocode,
+		'inputs': ['data/charging_points.csv'],
+		'outputs': ['data/location_data.csv'],
+		'code': ['extract_geocode.py'],
+		'optional': True,
+	},
+}
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# CONTENT HASHES
+# SHA-256 of a file, reused from the manifest while the size and the modification time of the file are the same
+def file_digest(path, known_files):
+	stat = os.stat(path)
+	known = known_files.get(path)
+	if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+		return known['sha256']
+
+	digest = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			digest.update(block)
+	known_files[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+	return known_files[path]['sha256']
+
+# Key of a stage run: the digests of its inputs and of its code, and the values of its `params`
+def stage_key(name, known_files, options):
+	stage = STAGES[name]
+	code_dir = os.path.dirname(os.path.abspath(__file__))
+	digests = [[path, file_digest(path, known_files)] for path in stage['inputs']]
+	digests += [[path, file_digest(os.path.join(code_dir, path), known_files)] for path in stage['code']]
+	digests += [[param, options[param]] for param in stage.get('params', [])]
+	return hashlib.sha256(json.dumps(digests).encode()).hexdigest()
+
+def load_manifest():
+	if not os.path.exists(MANIFEST_PATH):
+		return {'files': {}, 'stages': {}}
+	with open(MANIFEST_PATH) as f:
+		return json.load(f)
+
+def save_manifest(manifest):
+	os.makedirs(PIPELINE_DIR, exist_ok=True)
+	with open(MANIFEST_PATH + '.tmp', 'w') as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+	os.replace(MANIFEST_PATH + '.tmp', MANIFEST_PATH)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# SCHEDULING
+# The upstream stages of each stage: the ones writing its inputs
+def stage_dependencies(names):
+	producers = {output: name for name in names for output in STAGES[name]['outputs']}
+	return {name: {producers[path] for path in STAGES[name]['inputs'] if path in producers} for name in names}
+
+def is_up_to_date(name, key, manifest):
+	return manifest['stages'].get(name) == key and all(os.path.exists(path) for path in STAGES[name]['outputs'])
+
+def run_stages(names, workers=2, options=None, force=False):
+	options = {'workers': 1, 'count': 'rows', **(options or {})}
+	os.makedirs(PIPELINE_DIR, exist_ok=True)
+	manifest = load_manifest()
+	dependencies = stage_dependencies(names)
+	pending = set(names)
+	running = {}
+	ran, skipped = [], []
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		while pending or running:
+			# The stages whose upstream stages are all done, their inputs are final
+			ready = sorted(name for name in pending if not dependencies[name] & (pending | {name for name, _, _ in running.values()}))
+			for name in ready:
+				pending.discard(name)
+				missing = [path for path in STAGES[name]['inputs'] if not os.path.exists(path)]
+				if missing:
+					raise FileNotFoundError(f'Stage `{name}`: missing input(s) {missing}')
+				key = stage_key(name, manifest['files'], options)
+				if not force and is_up_to_date(name, key, manifest):
+					skipped.append(name)
+					print(f'[{name}] up to date, skipped')
+					continue
+				print(f'[{name}] running')
+				running[executor.submit(STAGES[name]['run'], options)] = (name, key, time.perf_counter())
+
+			if not running:
+				continue
+			done, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in done:
+				name, key, start = running.pop(future)
+				# Raises the error of the stage, the manifest keeps the stages completed so far
+				future.result()
+				# The outputs are hashed now, the downstream stages only hash them again if they are rewritten
+				for path in STAGES[name]['outputs']:
+					file_digest(path, manifest['files'])
+				manifest['stages'][name] = key
+				save_manifest(manifest)
+				ran.append(name)
+				print(f'[{name}] done in {time.perf_counter() - start:.1f}s')
+
+	return ran, skipped
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Runs the preprocessing stages whose inputs changed, see `STAGES`')
+	parser.add_argument('stages', nargs='*', help='Stages to consider (default: all of them), their upstream stages are not added')
+	parser.add_argument('--force', action='store_true', help='Run the stages even if their inputs did not change')
+	parser.add_argument('--workers', type=int, default=2, help='Number of stages running at the same time')
+	parser.add_argument('--stage-workers', type=int, default=1, help='Number of processes of the `epoints_clean` stage (see `epoints_preprocess.py --workers`)')
+	parser.add_argument('--count', choices=['rows', 'points', 'stations'], default='rows', help='What the charging points pivot counts (see `epoints_preprocess.py --count`)')
+	parser.add_argument('--geocode', action='store_true', help='Also run the reverse geocoding (PAID API, see `extract_geocode.py`)')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	names = args.stages or [name for name, stage in STAGES.items() if not stage.get('optional')]
+	if args.geocode and 'geocode' not in names:
+		names.append('geocode')
+	unknown = [name for name in names if name not in STAGES]
+	if unknown:
+		raise SystemExit(f'Unknown stage(s) {unknown}, expected some of {list(STAGES)}')
+
+	start = time.perf_counter()
+	ran, skipped = run_stages(names, workers=args.workers, options={'workers': args.stage_workers, 'count': args.count}, force=args.force)
+	print(f'Pipeline done in {time.perf_counter() - start:.1f}s: `{len(ran)}` stage(s) run, `{len(skipped)}` up to date')
+
+
+if __name__ == '__main__':
+	main()
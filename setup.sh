@@ -15,4 +15,4 @@ python3 -m pip install plotly
 # python3 -m pip install tqdm
 python3 -m pip install streamlit
 python3 -m pip install streamlit-folium
-python3 -m pip install unidecode
+python3 -m pip install pyarrow
@@ -0,0 +1,110 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Station density grid used by the density layer of the map `data/station_bins.npz`: the charging points counted
+# in square cells at several zoom levels, from the GPS coordinates parsed by `epoints_preprocess.py`.
+#
+# - level `z` (one per zoom of the map in `ZOOM_LEVELS`) has cells of `cell_size(z)` degrees, about 16 pixels
+#	at that zoom. All the grids start at (-180, -90) and the size halves from one level to the next, so each cell
+#	is split into 4 cells of the next level and the counts add up the same at every level
+# - only the non-empty cells are kept, per level: the cell `x`, `y` (int32), the department (`DEPT_CODES` position,
+#	int8), the year (int16) and the number of points `count` (int32), so the map can follow the selected
+#	department and year (cumulative, up to the selected year)
+#
+# The dashboard draws one image per level (see `density_grid()`) and shows the one matching the zoom of the map.
+# It is rebuilt at the end of `epoints_preprocess.py` (and by the `station_bins` stage of `pipeline.py`).
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import numpy as np
+import pandas as pd
+from dimensions import DEPT_DTYPE
+from instrumentation import profiled
+
+
+STATION_BINS = 'data/station_bins.npz'
+ZOOM_LEVELS = [5, 6, 7, 8, 9, 10]
+# Metropolitan France and Corsica (lat, lon), the points outside (swapped coordinates, overseas, ...) are left out
+BOUNDS = [[41.0, -5.5], [51.5, 10.0]]
+
+def cell_size(zoom):
+	return 360 / 2 ** zoom / 16
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Number of points per cell, department and year at every level, from the rows with `lat`, `lon`, `dept_code` and `year`
+@profiled()
+def build_station_bins(df):
+	lat = df['lat'].to_numpy(dtype=float, na_value=np.nan)
+	lon = df['lon'].to_numpy(dtype=float, na_value=np.nan)
+	dept = df['dept_code'].astype(DEPT_DTYPE).cat.codes.to_numpy()
+	year = df['year'].to_numpy(dtype=float, na_value=np.nan)
+	(lat_min, lon_min), (lat_max, lon_max) = BOUNDS
+	mask = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max) & (dept >= 0) & ~np.isnan(year)
+
+	# The cells of the finest level, the coarser levels are the same indices shifted (the sizes are powers of 2)
+	finest = max(ZOOM_LEVELS)
+	x = np.floor((lon[mask] + 180) / cell_size(finest)).astype(np.int32)
+	y = np.floor((lat[mask] + 90) / cell_size(finest)).astype(np.int32)
+	keys = pd.DataFrame({'dept': dept[mask].astype(np.int8), 'year': year[mask].astype(np.int16)})
+
+	arrays = {'zoom_levels': np.array(ZOOM_LEVELS, dtype=np.int16)}
+	for zoom in ZOOM_LEVELS:
+		keys['x'] = x >> (finest - zoom)
+		keys['y'] = y >> (finest - zoom)
+		counts = keys.groupby(['x', 'y', 'dept', 'year'], sort=True).size()
+		for name in ['x', 'y', 'dept', 'year']:
+			arrays[f'{name}_{zoom}'] = counts.index.get_level_values(name).to_numpy()
+		arrays[f'count_{zoom}'] = counts.to_numpy(dtype=np.int32)
+	return arrays
+
+def save_station_bins(arrays, path=STATION_BINS):
+	np.savez_compressed(path + '.tmp.npz', **arrays)
+	os.replace(path + '.tmp.npz', path)
+	print(f'The station density grid has been saved to `{path}` ({os.path.getsize(path) / 1024:,.0f} KB)')
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Level of the grid to show at a zoom of the map (the nearest one)
+def zoom_level(zoom):
+	return min(ZOOM_LEVELS, key=lambda level: abs(level - zoom))
+
+# The arrays of one level only (the other levels of the file are not read)
+def load_level(zoom, path=STATION_BINS):
+	level = zoom_level(zoom)
+	with np.load(path) as bins:
+		return {name: bins[f'{name}_{level}'] for name in ['x', 'y', 'dept', 'year', 'count']}
+
+# Dense grid of the number of points per cell over `BOUNDS` (first row at the north), counting the years up to
+# `year` and only the department `dept_code` if given. Returns the grid and its bounds [[south, west], [north, east]]
+@profiled()
+def density_grid(level_arrays, zoom, year, dept_code=None):
+	size = cell_size(zoom_level(zoom))
+	(lat_min, lon_min), (lat_max, lon_max) = BOUNDS
+	x0, x1 = int(np.floor((lon_min + 180) / size)), int(np.floor((lon_max + 180) / size))
+	y0, y1 = int(np.floor((lat_min + 90) / size)), int(np.floor((lat_max + 90) / size))
+
+	mask = level_arrays['year'] <= int(year)
+	if dept_code is not None:
+		mask &= level_arrays['dept'] == DEPT_DTYPE.categories.get_loc(dept_code)
+	width, height = x1 - x0 + 1, y1 - y0 + 1
+	flat = (y1 - level_arrays['y'][mask]) * width + (level_arrays['x'][mask] - x0)
+	grid = np.bincount(flat, weights=level_arrays['count'][mask], minlength=width * height).reshape(height, width)
+
+	bounds = [[y0 * size - 90, x0 * size - 180], [(y1 + 1) * size - 90, (x1 + 1) * size - 180]]
+	return grid.astype(np.int64), bounds
+
+# RGBA image of a grid (transparent where there is no point), the colors are picked by the class of each count
+# in `thresholds` (log-spaced from 1 to the highest count)
+def density_image(grid, colors):
+	thresholds = np.unique(np.geomspace(1, max(grid.max(), 1), len(colors) + 1).round().astype(np.int64))
+	classes = np.clip(np.searchsorted(thresholds, grid, side='right') - 1, 0, len(colors) - 1)
+	palette = np.array([[int(color[i:i + 2], 16) for i in (1, 3, 5)] + [255] for color in colors], dtype=np.uint8)
+	image = palette[classes]
+	image[grid == 0] = 0
+	return image, thresholds
+
+
+def main():
+	from epoints_preprocess import load_state
+	save_station_bins(build_station_bins(load_state()))
+
+
+if __name__ == '__main__':
+	main()
@@ -1,100 +1,187 @@
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Description: This script preprocesses the vehicles dataset `data/vehicules.csv` 
 # The final datasets are saved as `evs_pivot.csv` and `evs_pivot_cumsum.csv` in the `data` folder
+# The same numbers per commune are saved in `data/communes/`, one file per department (drill-down of the dashboard)
+# The data quality report of the dataset is saved in `data/quality/voitures.json` and `.html` (see `data_quality.py`)
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+import os
+import json
+import shutil
+import argparse
 import pandas as pd
 import numpy as np
-import streamlit as st
-
-# Load the dataset
+from ingest import load_cached_csv, read_csv_chunks, EVS_SPEC
+from metrics_cube import update_metrics_cube
+from dept_index import insee_dept_codes, dept_names_map
+from dimensions import dept_names, years, pivot_dept_year, code_year_matrix, add_total, cumsum_pivot, fill_years, COMMUNES_DIR
+from data_quality import profile_frame, profile_chunks, report_table, save_report, EVS_CHECKS
+from instrumentation import profiled, enable, run_profiled, add_profile_argument, debug_panel
+
+EVS_COLUMNS = {
+	'CODGEO': 'codgeo',
+	'LIBGEO': 'libgeo',
+	'EPCI': 'epci',
+	'LIBEPCI': 'libepci',
+	'DATE_ARRETE': 'date_arrete',
+	'NB_VP_RECHARGEABLES_EL': 'nb_evs',
+	# 'nb_vp_rechargeables_el': 'nb_evs',
+}
+
+# Load the dataset, only the needed columns from the Parquet cache (see `ingest.py`)
+@profiled()
 def load_dataset():
-	df = pd.read_csv('data/voitures.csv', sep=';', dtype=str)
-	df = df.rename(columns={
-        'CODGEO': 'codgeo',
-        'LIBGEO': 'libgeo',
-        'EPCI': 'epci',
-        'LIBEPCI': 'libepci',
-        'DATE_ARRETE': 'date_arrete',
-        'NB_VP_RECHARGEABLES_EL': 'nb_evs',
-        # 'nb_vp_rechargeables_el': 'nb_evs',
-    })	
+	df = load_cached_csv('data/voitures.csv', EVS_SPEC)
+	df = df.rename(columns=EVS_COLUMNS)
 	return df
 
-# This will display the number of missing values in each column (missing in RED, no missing in GREEN)
-# @st.cache_data
-def display_missing_values(charging_points):
-	st.write(f"DEBUG: Missing values in :")
-	for column in charging_points.columns:	
-		missing_values = charging_points[column].isna().sum()
-		if missing_values > 0:
-			st.markdown(f"<font color='red'>**{column}: {missing_values}**</font>", unsafe_allow_html=True)
-		else:
-			st.markdown(f"<font color='green'>**{column}: {missing_values}**</font>", unsafe_allow_html=True)
+# Load the dataset by chunks of `chunksize` rows (streaming mode, see `transform_to_pivot_chunked()`)
+def load_dataset_chunks(chunksize):
+	for chunk in read_csv_chunks('data/voitures.csv', EVS_SPEC, chunksize):
+		yield chunk.rename(columns=EVS_COLUMNS)
 
 # This function adds a new columns with department code and name
+# The department codes and names come from the prebuilt index shared with `epoints_preprocess.py` (see `dept_index.py`)
+@profiled()
 def adding_department(df):
-	# Creating new column with department code
-	dept_code = df['codgeo'].str[:2]
-	df.insert(0, 'dept_code', dept_code)	
+	# Creating new column with department code (categorical, computed once per commune)
+	dept_code = insee_dept_codes(df['codgeo'])
+	df.insert(0, 'dept_code', dept_code)
 
-	dept_code_filter = [str(i).zfill(2) for i in range(1, 96)] + ['2A', '2B']
-	df = df[df['dept_code'].isin(dept_code_filter)].copy()
+	# Keeping the departments 01-95 + 2A + 2B only (the other codes are missing in the categorical `dept_code`)
+	df = df[df['dept_code'].notnull()].copy()
 
 	# Creating new column with department name
-	fr_dep_df = pd.read_csv('data/fr-ref-geo.csv', sep=';', dtype=str)
-	dep_to_name = fr_dep_df.set_index('DEP_CODE')['DEP_NOM'].to_dict()
-	df['dept_name'] = df['dept_code'].map(dep_to_name)
+	df['dept_name'] = dept_names(df['dept_code'], dept_names_map())
 
-	# Creating new `year` column
-	df['year'] = df['date_arrete'].str.slice(0, 4)
-	df = df[['dept_code', 'dept_name', 'year', 'nb_evs']]
+	# Creating new `year` column (small integer, computed once per distinct `date_arrete`)
+	df['year'] = years(df['date_arrete'])
+	# The commune columns are kept for the commune tables (see `transform_to_communes()`)
+	df = df[['dept_code', 'dept_name', 'year', 'nb_evs', 'codgeo', 'libgeo', 'epci', 'libepci']]
 
 	return df
 
 # THis function will transform the dataset to a pivot table with the following columns:
-# ['dept_code', 'dept_name', '2020', '2021', '2022', '2023', '2024', 'total']
+# ['dept_code', 'dept_name', <one column per year, from the first to the last year of `date_arrete`>, 'total']
+@profiled()
 def transform_to_pivot(df):
-	df['nb_evs'] = pd.to_numeric(df['nb_evs'], errors='coerce')
-	pivot_df = pd.pivot_table(df, index=['dept_code', 'dept_name'], columns='year', values='nb_evs', aggfunc='sum', fill_value=0)
-	# pivot_df['total'] = pivot_df.iloc[:, 2:].sum(axis=1)
-	pivot_df['total'] = pivot_df.loc[:, '2020':'2025'].sum(axis=1)
-
+	pivot_df = pivot_dept_year(df, values='nb_evs')
 	return pivot_df
 
+# Streaming version of `adding_department()` + `transform_to_pivot()` + `transform_to_communes()`:
+# each chunk is reduced to its sums per department (and commune) and year, which are folded into the accumulators.
+# The peak memory depends on the number of communes x years and the chunk size, not on the file size.
+@profiled()
+def transform_to_pivot_chunked(chunks):
+	accumulator = None
+	communes = None
+	for chunk in chunks:
+		df = adding_department(chunk)
+		partial = pivot_dept_year(df, values='nb_evs').drop(columns='total')
+		accumulator = partial if accumulator is None else accumulator.add(partial, fill_value=0)
+		communes = transform_to_communes(df) if communes is None else add_communes(communes, transform_to_communes(df))
+
+	if accumulator is None:
+		raise ValueError('No rows in `data/voitures.csv`')
+
+	# Same layout as the in-memory path (the chunks may not have the same departments and years)
+	pivot_df = fill_years(accumulator.fillna(0).astype(np.int64).sort_index())
+	return add_total(pivot_df), communes
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# COMMUNES
+# Number of EVs per commune and year, same values as `transform_to_pivot()` one level down. Indexed by `codgeo`, with
+# the columns `COMMUNE_COLUMNS` (the last ones found for the commune), one column per year and `total`
+COMMUNE_COLUMNS = ['dept_code', 'libgeo', 'epci', 'libepci']
+
+@profiled()
+def transform_to_communes(df):
+	codgeo = df['codgeo'].astype('category').cat.remove_unused_categories()
+	matrix, year_columns, observed = code_year_matrix(codgeo.cat.codes.to_numpy(), len(codgeo.cat.categories), df['year'], df['nb_evs'])
+
+	communes = add_total(pd.DataFrame(matrix, index=pd.Index(codgeo.cat.categories.astype(str), name='codgeo'), columns=year_columns))
+	codes = codgeo.cat.codes.to_numpy()
+	mask = codes >= 0
+	for column in reversed(COMMUNE_COLUMNS):
+		values = np.full(len(communes), None, dtype=object)
+		values[codes[mask]] = df[column].astype(object).to_numpy()[mask]
+		communes.insert(0, column, values)
+	return communes[observed]
+
+# Adding the commune tables of two parts of the dataset
+def add_communes(communes, other):
+	columns = other[COMMUNE_COLUMNS].combine_first(communes[COMMUNE_COLUMNS])
+	counts = communes.drop(columns=COMMUNE_COLUMNS + ['total']).add(other.drop(columns=COMMUNE_COLUMNS + ['total']), fill_value=0)
+	counts = fill_years(counts.fillna(0).astype(np.int64).sort_index())
+	return columns.join(add_total(counts))
+
+# One Parquet file per department `data/communes/<dept_code>.parquet`, so the dashboard only reads the selected one,
+# plus `index.json` (number of communes of each department). The whole folder is replaced at once
+@profiled()
+def save_communes(communes, directory=COMMUNES_DIR):
+	tmp_dir = directory + '.tmp'
+	shutil.rmtree(tmp_dir, ignore_errors=True)
+	os.makedirs(tmp_dir)
+	index = {}
+	for dept_code, partition in communes.groupby('dept_code', sort=True):
+		partition.drop(columns='dept_code').sort_index().to_parquet(os.path.join(tmp_dir, f'{dept_code}.parquet'))
+		index[dept_code] = len(partition)
+	with open(os.path.join(tmp_dir, 'index.json'), 'w') as f:
+		json.dump(index, f, indent=1)
+
+	shutil.rmtree(directory, ignore_errors=True)
+	os.replace(tmp_dir, directory)
+	print(f'The communes of `{len(index)}` departments have been saved in `{directory}`')
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+@profiled()
+def save_pivot(df_pivot):
+	df_pivot.to_csv('data/evs_pivot.csv')
+
+	# Saving the cumulative sum of the number of EVs as well
+	df_pivot_cumsum = cumsum_pivot(df_pivot)
+	df_pivot_cumsum.to_csv('data/evs_pivot_cumsum.csv')
+
+	print('The final datasets `evs_pivot.csv` and `evs_pivot_cumsum.csv` have been saved in the `data` folder')
+
+	# The dashboard metrics need the charging points dataset as well (see `metrics_cube.py`)
+	update_metrics_cube()
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Preprocessing of the vehicles dataset `data/voitures.csv`')
+	parser.add_argument('--chunksize', type=int, help='Streaming mode: read and aggregate `voitures.csv` by chunks of this many rows')
+	add_profile_argument(parser)
+	return parser.parse_args()
+
+
+def run_pipeline(args):
+	if args.chunksize:
+		# The data quality report is added up chunk by chunk, in the same pass
+		report = {}
+		df_pivot, communes = transform_to_pivot_chunked(profile_chunks(load_dataset_chunks(args.chunksize), EVS_CHECKS, 'voitures', report))
+		save_pivot(df_pivot)
+		save_communes(communes)
+		save_report(report['report'])
+		return
 
-def main():
 	evs_df = load_dataset() 
+	report = profile_frame(evs_df, EVS_CHECKS, 'voitures')
 	
 	df = adding_department(evs_df)
 
-	# df_pivot = transform_to_pivot(df)
+	df_pivot = transform_to_pivot(df)
+	save_pivot(df_pivot)
+	save_communes(transform_to_communes(df))
+	save_report(report)
 
-	# df_pivot.to_csv('data/evs_pivot.csv')
+	# DEBUG # Only shown when the script is launched with `streamlit run vehicles_preprocess.py`
+	debug_panel({'evs_df': evs_df, 'df': df, 'data quality': report_table(report)})
 
-	# Saving the cumulative sum of the number of EVs as well
-	# df_pivot_cumsum = df_pivot.loc[:, '2020':'2025'].cumsum(axis=1)
-	# df_pivot_cumsum.to_csv('data/evs_pivot_cumsum.csv')
-
-	# print('The final datasets `evs_pivot.csv` and `evs_pivot_cumsum.csv` have been saved in the `data` folder')
-
-	# DEBUG #
-	# TO RUN THE FOLLOWING CODE THE STREAMLIT APP NEEDS TO BE LAUNCHED FIRST
-	st.write(evs_df.shape)
-	st.write(evs_df)
-	display_missing_values(df)
-	st.write(df.shape)
-	st.write(df)
-
-	# # filter_df = df.drop_duplicates(subset=['year'])
-	# st.write(df_pivot.shape)
-	# st.write(df_pivot)
-	# st.write(f'The final dataset has been saved as `evs_pivot.csv` in the `data` folder')
-
-	# st.write(df_pivot_cumsum.shape)
-	# st.write(df_pivot_cumsum)
-	# st.write(f'The final dataset has been saved as `evs_pivot_cumsum.csv` in the `data` folder')
-	# # # # #
+def main():
+	args = parse_args()
+	if args.profile:
+		enable(args.profile)
+	run_profiled(lambda: run_pipeline(args), 'vehicles_preprocess')
 
 
 if __name__ == '__main__':